@@ -676,22 +676,20 @@ def delete_profile(current_user, sus_user_id):
 
 # ==================== LOG INGESTION (from Proxy) ====================
 
-@app.route('/api/ingest_log', methods=['POST'])
-def ingest_log():
-    data = request.get_json()
-    if not data:
-        return jsonify({'error': 'No data provided'}), 400
-    
-    # Create WAF Log
+def _add_ingested_log(data):
+    """Stage WAFLog/Alert/SysLog rows for one proxy log entry (caller commits)."""
     waf_log = WAFLog(
         intercepted_req=data.get('url', '') + ' ' + data.get('body', ''),
         wlog_type=data.get('reason', 'Unknown'),
         severity=data.get('severity', 'Medium'),
         detection_source=data.get('detection_source', 'WAF')
     )
+    # Entries may arrive batched or replayed late; keep the proxy's event time
+    if data.get('ts'):
+        waf_log.wlog_timestamp = datetime.utcfromtimestamp(float(data['ts']))
     db.session.add(waf_log)
-    db.session.commit()
-    
+    db.session.flush()
+
     # Create Alert if blocked/alerted
     verdict = data.get('verdict')
     if verdict in ['blocked', 'alert']:
@@ -701,18 +699,42 @@ def ingest_log():
             wlog_id=waf_log.wlog_id
         )
         db.session.add(alert)
-        db.session.commit()
-    
+
     # Add System Log for activity
     sys_log = SysLog(
         message=f"Ingested {waf_log.severity} severity WAF log: {waf_log.wlog_type}"
     )
     db.session.add(sys_log)
+    return waf_log
+
+
+@app.route('/api/ingest_log', methods=['POST'])
+def ingest_log():
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+    
+    waf_log = _add_ingested_log(data)
     db.session.commit()
     
     return jsonify({'success': True, 'wlog_id': waf_log.wlog_id})
 
 
+@app.route('/api/ingest_logs', methods=['POST'])
+def ingest_logs():
+    """Bulk variant of ingest_log: accepts a JSON list of entries, one commit."""
+    data = request.get_json()
+    if isinstance(data, dict):
+        data = data.get('logs')
+    if not data or not isinstance(data, list):
+        return jsonify({'error': 'No data provided'}), 400
+    
+    waf_logs = [_add_ingested_log(entry) for entry in data if isinstance(entry, dict)]
+    db.session.commit()
+    
+    return jsonify({'success': True, 'count': len(waf_logs), 'wlog_ids': [w.wlog_id for w in waf_logs]})
+
+
 # ==================== THREAT LOOKUP ====================
 
 @app.route('/api/threat/lookup', methods=['GET'])
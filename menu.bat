@@ -157,8 +157,8 @@ goto menu
 cls
 echo [*] Viewing recent logs...
 echo.
-if exist proxy\dataset\traffic.jsonl (
-    type proxy\dataset\traffic.jsonl
+if exist proxy\dataset\traffic\traffic-*.jsonl (
+    type proxy\dataset\traffic\traffic-*.jsonl
 ) else (
     echo No logs found. Run some requests through the WAF first.
 )
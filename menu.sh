@@ -53,7 +53,7 @@ while true; do
             ;;
         6)
             echo -e "\n${BLUE}[*] Tailing logs (Ctrl+C to stop)...${NC}"
-            tail -f dataset/traffic.jsonl
+            tail -F "$(ls -1 proxy/dataset/traffic/traffic-*.jsonl 2>/dev/null | tail -1)"
             ;;
         0)
             echo -e "\nExiting..."
@@ -0,0 +1,123 @@
+"""
+Collapsed-decoder scoring for CharAutoencoder.
+
+The decoder feeds the same relu(dec_fc(z)) vector to every position before
+dec_conv1 (kernel 5, zero padding 2) and the 1x1 dec_out. A position's
+logits therefore depend only on which of the 5 kernel taps fall inside the
+sequence: every interior position gets identical logits, and only the two
+positions at each edge differ. Instead of materializing [B, vocab, L] logits,
+score_rows() computes the decoder once per distinct tap window (at most 5
+per sample), takes log_softmax once, and gathers each character's
+log-probability by position. The encoder runs unchanged.
+
+ScoringHead wraps the same computation as an nn.Module with no Python-side
+shape logic, so it can be scripted or exported (see export_model.py).
+"""
+
+from functools import lru_cache
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+@lru_cache(maxsize=64)
+def _tap_windows(length: int, kernel: int, padding: int):
+    """Valid-tap masks [W, kernel] and the window index of each position [length]."""
+    windows = {}
+    index = []
+    for t in range(length):
+        lo = max(0, padding - t)
+        hi = min(kernel - 1, length - 1 - t + padding)
+        index.append(windows.setdefault((lo, hi), len(windows)))
+    masks = torch.zeros(len(windows), kernel)
+    for (lo, hi), w in windows.items():
+        masks[w, lo:hi + 1] = 1.0
+    return masks, torch.tensor(index, dtype=torch.long)
+
+
+@torch.no_grad()
+def score_rows(model, x_ids: torch.Tensor, pad_id: int) -> torch.Tensor:
+    """Mean per-character reconstruction loss of each row of x_ids [B, L], ignoring padding."""
+    batch, length = x_ids.shape
+
+    # Encoder, exactly as CharAutoencoder.forward
+    e = model.emb(x_ids).transpose(1, 2)
+    h = torch.relu(model.enc_conv1(e))
+    h = torch.relu(model.enc_conv2(h))
+    z = model.enc_fc(torch.max(h, dim=2).values)
+
+    # Decoder collapsed to one output per tap window
+    conv = model.dec_conv1
+    d = torch.relu(model.dec_fc(z))                                   # [B, C]
+    kernel = conv.kernel_size[0]
+    tap_weight = conv.weight.permute(2, 0, 1).reshape(kernel * conv.out_channels, conv.in_channels)
+    taps = F.linear(d, tap_weight).view(batch, kernel, conv.out_channels)   # [B, K, C]
+    masks, window_of = _tap_windows(length, kernel, conv.padding[0])
+    masks, window_of = masks.to(x_ids.device), window_of.to(x_ids.device)
+    pre = torch.matmul(masks, taps) + conv.bias                       # [B, W, C]
+    logits = F.linear(torch.relu(pre), model.dec_out.weight.squeeze(-1), model.dec_out.bias)
+    log_probs = F.log_softmax(logits, dim=-1)                         # [B, W, V]
+
+    vocab = log_probs.size(-1)
+    flat = window_of.unsqueeze(0) * vocab + x_ids                     # [B, L]
+    loss = -log_probs.reshape(batch, -1).gather(1, flat)
+    mask = (x_ids != pad_id).float()
+    return (loss * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+
+
+class ScoringHead(nn.Module):
+    """
+    CharAutoencoder + masked-loss head: x_ids [B, L] -> ae_score [B].
+
+    Same math as score_rows(), with the tap windows derived from tensor ops
+    instead of the cached table. For L >= kernel there are always
+    2 * padding + 1 windows: position t uses window
+    min(t, padding) + max(0, t - (L - 1 - padding)), so the left edge gets
+    windows 0..padding-1, the interior `padding` and the right edge the rest.
+    """
+
+    def __init__(self, model, pad_id: int):
+        super().__init__()
+        self.model = model
+        self.pad_id = pad_id
+        conv = model.dec_conv1
+        kernel, padding = conv.kernel_size[0], conv.padding[0]
+        self.padding = padding
+        self.kernel = kernel
+        self.channels = conv.out_channels
+        masks = torch.ones(2 * padding + 1, kernel)
+        for w in range(padding):
+            masks[w, :padding - w] = 0.0
+            masks[2 * padding - w, kernel - padding + w:] = 0.0
+        self.register_buffer("masks", masks)
+        # Decoder weights in the layout the collapsed computation uses
+        tap_weight = conv.weight.permute(2, 0, 1).reshape(kernel * conv.out_channels, conv.in_channels)
+        self.register_buffer("tap_weight", tap_weight.detach().clone())
+        self.register_buffer("tap_bias", conv.bias.detach().clone())
+        self.register_buffer("out_weight", model.dec_out.weight.squeeze(-1).detach().clone())
+        self.register_buffer("out_bias", model.dec_out.bias.detach().clone())
+
+    def forward(self, x_ids: torch.Tensor) -> torch.Tensor:
+        model = self.model
+        batch = x_ids.size(0)
+        length = x_ids.size(1)
+
+        e = model.emb(x_ids).transpose(1, 2)
+        h = torch.relu(model.enc_conv1(e))
+        h = torch.relu(model.enc_conv2(h))
+        z = model.enc_fc(torch.max(h, dim=2).values)
+
+        d = torch.relu(model.dec_fc(z))
+        taps = F.linear(d, self.tap_weight).view(batch, self.kernel, self.channels)
+        pre = torch.matmul(self.masks, taps) + self.tap_bias
+        logits = F.linear(torch.relu(pre), self.out_weight, self.out_bias)
+        log_probs = F.log_softmax(logits, dim=-1)
+
+        t = torch.arange(length, device=x_ids.device)
+        window_of = torch.clamp(t, max=self.padding) + torch.clamp(t - (length - 1 - self.padding), min=0)
+        vocab = log_probs.size(-1)
+        flat = window_of.unsqueeze(0) * vocab + x_ids
+        loss = -log_probs.reshape(batch, -1).gather(1, flat)
+        mask = (x_ids != self.pad_id).float()
+        return (loss * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
@@ -4,27 +4,69 @@ Uses CharAutoencoder deep learning model trained on benign traffic.
 Malicious requests produce high reconstruction errors.
 """
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Literal, Optional
 import torch
 import torch.nn as nn
+import numpy as np
 import json
 import uvicorn
 import os
+import asyncio
+import hashlib
 import logging
+import secrets
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
+from batcher import DynamicBatcher
+from ae_scoring import score_rows
+from char_encoding import CharEncoder
+from backends import load_scorer
+from int8_model import quantize_model
+from score_cache import ScoreCache, cache_key
+from registry import BASE_VERSION, ModelRegistry, VersionStats
+from shadow import ShadowScorer
 
 # Logging config
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("ml_service")
 
-# Paths to model artifacts (relative to app.py)
+# Model artifacts (relative to app.py): the flat ARTIFACTS_DIR is version
+# "base", further versions live in MODEL_REGISTRY_DIR (see registry.py)
 ARTIFACTS_DIR = "ae_artifacts"
-BUNDLE_FILE = os.path.join(ARTIFACTS_DIR, "bundle.json")
-VOCAB_FILE = os.path.join(ARTIFACTS_DIR, "char_vocab.json")
-MODEL_FILE = os.path.join(ARTIFACTS_DIR, "char_ae_best.pt")
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(ARTIFACTS_DIR, "versions"))
+
+# File names inside a version directory
+BUNDLE_FILE = "bundle.json"
+VOCAB_FILE = "char_vocab.json"
+MODEL_FILE = "char_ae_best.pt"
+INT8_MODEL_FILE = "char_ae_int8.pt"
+
+# Version served at startup; unset means the registry's ACTIVE version, else
+# base. A pinned MODEL_VERSION is not changed by other workers' swaps.
+MODEL_VERSION = os.getenv("MODEL_VERSION", "").strip()
+
+# Seconds between checks of the registry's ACTIVE and THRESHOLDS files, so
+# every worker follows a swap or POST /config made through any of them (0 disables)
+MODEL_POLL_INTERVAL = float(os.getenv("MODEL_POLL_INTERVAL", "5"))
+
+# Bearer token required by the /admin endpoints; unset leaves them open like /config
+ML_ADMIN_TOKEN = os.getenv("ML_ADMIN_TOKEN", "")
+
+# Candidate version scored in the shadow of the active one (see shadow.py):
+# SHADOW_SAMPLE_RATE of the scored requests, at most SHADOW_CPU_BUDGET of one
+# core, in passes of up to SHADOW_MAX_BATCH texts, fewer while passes take over
+# SHADOW_MAX_MS. Unset SHADOW_VERSION (or POST /admin/shadow/{version}) to
+# start without a candidate.
+SHADOW_VERSION = os.getenv("SHADOW_VERSION", "").strip()
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+SHADOW_CPU_BUDGET = float(os.getenv("SHADOW_CPU_BUDGET", "0.05"))
+SHADOW_MAX_BATCH = int(os.getenv("SHADOW_MAX_BATCH", "8"))
+SHADOW_MAX_MS = float(os.getenv("SHADOW_MAX_MS", "5"))
 
 # Thresholds for classification
 LOW_THRESHOLD = 3.80   
@@ -33,6 +75,51 @@ HIGH_THRESHOLD = 4.90
 # Device configuration
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# Largest batch accepted by /predict/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "64"))
+
+# Dynamic batching: forward passes hold up to SCHED_MAX_BATCH texts, and a
+# request waits at most SCHED_MAX_DELAY_MS for others to join its batch
+SCHED_MAX_BATCH = int(os.getenv("SCHED_MAX_BATCH", "32"))
+SCHED_MAX_DELAY_MS = float(os.getenv("SCHED_MAX_DELAY_MS", "2"))
+
+# Inference runs on INFERENCE_THREADS dedicated threads, never on the event
+# loop. Each forward pass uses TORCH_THREADS intra-op threads; by default the
+# cores are split evenly between inference threads so they don't oversubscribe.
+INFERENCE_THREADS = max(1, int(os.getenv("INFERENCE_THREADS", "1")))
+TORCH_THREADS = max(1, int(os.getenv("TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // INFERENCE_THREADS)))))
+TORCH_INTEROP_THREADS = max(1, int(os.getenv("TORCH_INTEROP_THREADS", "1")))
+
+torch.set_num_threads(TORCH_THREADS)
+try:
+    torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+except RuntimeError:
+    pass  # already set (module re-imported after torch started parallel work)
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+# Candidate scoring gets its own thread so it never queues ahead of a batch
+shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+
+# Batches are padded to the smallest of these lengths that fits (see
+# pad_length) instead of always to max_len. "off" restores fixed max_len.
+LENGTH_BUCKETS = os.getenv("LENGTH_BUCKETS", "32,48,64,96,128,192,256")
+
+# Score batches with the collapsed decoder (ae_scoring.py) instead of a full
+# forward pass; set to 0 to use CharAutoencoder.forward
+COLLAPSED_DECODER = os.getenv("COLLAPSED_DECODER", "1").strip().lower() in ("1", "true", "yes", "on")
+
+# Runtime for batch scoring: eager, torchscript or onnxruntime. The exported
+# backends need python export_model.py to have been run (see backends.py).
+ML_BACKEND = os.getenv("ML_BACKEND", "eager").strip().lower()
+
+# fp32 serves char_ae_best.pt; int8 serves char_ae_int8.pt, written by
+# quantize_model.py once it passes the accuracy gate (CPU, eager backend only)
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32").strip().lower()
+
+# Raw ae_scores of recent model inputs (LRU, cleared when the model changes);
+# 0 disables the cache
+SCORE_CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", "50000"))
+
 
 class CharAutoencoder(nn.Module):
     """
@@ -76,10 +163,38 @@ class CharAutoencoder(nn.Module):
         return logits, z
 
 
-# Model and vocabulary (loaded on startup)
+class LoadedModel:
+    """
+    One artifact version loaded for serving: weights, vocabulary and the state
+    derived from them. A batch takes one LoadedModel reference and reads
+    nothing else, so swapping `active` never mixes versions inside a batch.
+    """
+    def __init__(self, version: str, directory: str):
+        self.version = version
+        self.directory = directory
+        self.ae_model = None
+        self.stoi = {}
+        self.itos = []
+        self.char_encoder = None
+        self.pad_id = 0
+        self.unk_id = 1
+        self.vocab_size = 0
+        self.max_len = 256
+        self.ae_emb = 64
+        self.ae_latent = 128
+        self.ce_tok = None
+        self.digest = ""          # short hash of the served weights + vocabulary
+        self.pad_buckets = []
+        self.backend_scorer = None  # exported scoring head for ML_BACKEND; None when eager
+        self.loaded_at = time.time()
+        self.stats = version_stats.setdefault(version, VersionStats())
+
+
+# Model and vocabulary of the active version (mirrors `active`, see activate())
 ae_model = None
 stoi = {}           
 itos = []           
+char_encoder = None  # CharEncoder over itos
 pad_id = 0
 unk_id = 1
 vocab_size = 0
@@ -90,6 +205,29 @@ ae_latent = 128
 # Cross-entropy loss for computing reconstruction error
 ce_tok = None
 
+# Short hash of the loaded weights + vocabulary (see model_tag())
+model_digest = ""
+
+# Index of this process among serve.py workers (0 when run by uvicorn directly)
+worker_id = 0
+# Number of serve.py workers sharing the listening socket
+worker_count = 1
+
+# Sorted padded lengths usable for inference; [max_len] when bucketing is off
+pad_buckets = []
+
+# Padding beyond the text needed for scores identical to padding to max_len:
+# the two k=5 encoder convs see 4 positions to each side, the pool must still
+# see a pure-padding position, and the conv zero-padding at the right edge
+# must stay clear of it (see pad_length).
+PAD_MARGIN = 7
+
+registry = ModelRegistry(MODEL_REGISTRY_DIR, ARTIFACTS_DIR)
+active = None       # LoadedModel that new batches are scored with
+previous = None     # the model active before it, kept loaded for rollback
+version_stats = {}  # version -> VersionStats, for as long as the process runs
+model_loads = {}    # version -> status of its last load / warm-up / swap
+
 
 app = FastAPI(
     title="Zero-Day URL Attack Detection API",
@@ -117,6 +255,10 @@ class ProxyRequest(BaseModel):
     """Request format from proxy (raw_request wrapper)"""
     raw_request: dict
 
+class BatchProxyRequest(BaseModel):
+    """Batch of proxy raw_request payloads, scored together"""
+    requests: list[dict]
+
 class PredictionResponse(BaseModel):
     """Prediction result for a single URL"""
     url: str
@@ -131,71 +273,354 @@ class ThresholdConfig(BaseModel):
     high_threshold: float = 4.90
 
 
-def load_model():
-    """Load model artifacts on startup."""
-    global ae_model, stoi, itos, pad_id, unk_id, vocab_size, max_len, ae_emb, ae_latent, ce_tok
+def artifact_digest(*paths: str) -> str:
+    """Short blake2b hash over the contents of the given artifact files."""
+    digest = hashlib.blake2b(digest_size=8)
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def load_version(version: str, backend: bool = True) -> LoadedModel:
+    """
+    Load one artifact version from the registry. backend=False skips
+    load_backend(), for a pre-fork parent whose workers create their own
+    runtime sessions.
+    """
+    directory = registry.path(version)
+    m = LoadedModel(version, directory)
+    bundle_file, vocab_file, model_file, int8_file = (
+        os.path.join(directory, name) for name in (BUNDLE_FILE, VOCAB_FILE, MODEL_FILE, INT8_MODEL_FILE)
+    )
     
     logger.info("=" * 60)
-    logger.info(" Loading Zero-Day Detection Model...")
+    logger.info(f" Loading Zero-Day Detection Model (version {version})...")
     logger.info("=" * 60)
     
     # Load bundle configuration
-    if not os.path.exists(BUNDLE_FILE):
-        raise FileNotFoundError(f"Bundle file not found: {BUNDLE_FILE}")
-    
-    with open(BUNDLE_FILE, "r", encoding="utf-8") as f:
+    with open(bundle_file, "r", encoding="utf-8") as f:
         bundle = json.load(f)
     
-    max_len = int(bundle["HYB_MAX_LEN"])
-    ae_emb = int(bundle["AE_EMB"])
-    ae_latent = int(bundle["AE_LATENT"])
+    m.max_len = int(bundle["HYB_MAX_LEN"])
+    m.ae_emb = int(bundle["AE_EMB"])
+    m.ae_latent = int(bundle["AE_LATENT"])
     original_threshold = float(bundle["AE_T2"])
     
-    logger.info(f"   Max Length: {max_len}")
-    logger.info(f"   Embedding Dim: {ae_emb}")
-    logger.info(f"   Latent Dim: {ae_latent}")
+    logger.info(f"   Max Length: {m.max_len}")
+    logger.info(f"   Embedding Dim: {m.ae_emb}")
+    logger.info(f"   Latent Dim: {m.ae_latent}")
     logger.info(f"   Original Threshold: {original_threshold:.4f}")
     
     # Load vocabulary
-    with open(VOCAB_FILE, "r", encoding="utf-8") as f:
+    with open(vocab_file, "r", encoding="utf-8") as f:
         vocab_data = json.load(f)
     
-    itos = vocab_data["itos"]
-    stoi = {ch: i for i, ch in enumerate(itos)}
-    pad_id = stoi.get("<PAD>", 0)
-    unk_id = stoi.get("<UNK>", 1)
-    vocab_size = len(itos)
+    m.itos = vocab_data["itos"]
+    m.stoi = {ch: i for i, ch in enumerate(m.itos)}
+    m.pad_id = m.stoi.get("<PAD>", 0)
+    m.unk_id = m.stoi.get("<UNK>", 1)
+    m.vocab_size = len(m.itos)
+    m.char_encoder = CharEncoder(m.itos, m.pad_id, m.unk_id)
     
-    logger.info(f"   Vocabulary Size: {vocab_size}")
+    logger.info(f"   Vocabulary Size: {m.vocab_size}")
     
     # Load model
-    ae_model = CharAutoencoder(vocab_size, ae_emb, ae_latent, pad_id).to(DEVICE)
-    ae_model.load_state_dict(torch.load(MODEL_FILE, map_location=DEVICE, weights_only=True))
-    ae_model.eval()
+    model = CharAutoencoder(m.vocab_size, m.ae_emb, m.ae_latent, m.pad_id).to(DEVICE)
+    source_digest = artifact_digest(bundle_file, vocab_file, model_file)
+    if MODEL_PRECISION == "int8":
+        if DEVICE.type != "cpu" or ML_BACKEND != "eager":
+            raise ValueError("MODEL_PRECISION=int8 runs on the CPU with ML_BACKEND=eager only")
+        saved = torch.load(int8_file, map_location="cpu", weights_only=True)
+        if saved["source_digest"] != source_digest:
+            raise RuntimeError(
+                f"{int8_file} was quantized from model {saved['source_digest']}, "
+                f"current artifacts are {source_digest} (rerun python quantize_model.py)"
+            )
+        model = quantize_model(model)
+        model.load_state_dict(saved["state_dict"])
+        m.digest = artifact_digest(bundle_file, vocab_file, int8_file)
+    elif MODEL_PRECISION == "fp32":
+        model.load_state_dict(torch.load(model_file, map_location=DEVICE, weights_only=True))
+        m.digest = source_digest
+    else:
+        raise ValueError(f"Unknown MODEL_PRECISION {MODEL_PRECISION!r}, expected fp32 or int8")
+    model.eval()
+    m.ae_model = model
+    logger.info(f"   Precision: {MODEL_PRECISION}")
     
     # Initialize cross-entropy loss
-    ce_tok = nn.CrossEntropyLoss(ignore_index=pad_id, reduction="none")
+    m.ce_tok = nn.CrossEntropyLoss(ignore_index=m.pad_id, reduction="none")
+
+    # Shorter padding is only exact if <PAD> embeds to zero, like conv zero-padding
+    exact_padding = bool((model.emb.weight[m.pad_id] == 0).all())
+    if LENGTH_BUCKETS.strip().lower() != "off" and exact_padding:
+        sizes = {int(b) for b in LENGTH_BUCKETS.split(",") if b.strip()}
+        m.pad_buckets = sorted({b for b in sizes if b < m.max_len} | {m.max_len})
+    else:
+        m.pad_buckets = [m.max_len]
+    logger.info(f"   Length Buckets: {m.pad_buckets}")
+
+    if backend:
+        load_backend(m)
     
     logger.info(f"   Device: {DEVICE}")
+    logger.info(f"   Digest: {m.digest}")
     logger.info("=" * 60)
-    logger.info(" Model loaded successfully!")
+    return m
+
+def activate(model: LoadedModel):
+    """Make `model` the one new batches use and mirror it into the module globals."""
+    global active, previous, ae_model, stoi, itos, char_encoder, pad_id, unk_id, vocab_size, max_len, ae_emb, ae_latent, ce_tok, model_digest, pad_buckets
+    if active is not None and active is not model:
+        previous = active
+    active = model
+    ae_model, stoi, itos, char_encoder = model.ae_model, model.stoi, model.itos, model.char_encoder
+    pad_id, unk_id, vocab_size, max_len = model.pad_id, model.unk_id, model.vocab_size, model.max_len
+    ae_emb, ae_latent, ce_tok, model_digest = model.ae_emb, model.ae_latent, model.ce_tok, model.digest
+    pad_buckets = model.pad_buckets
+    score_cache.set_model(model.digest)
+
+def load_model(backend: bool = True):
+    """
+    Load and activate the startup version: MODEL_VERSION if set, else the
+    registry's ACTIVE version, else base.
+    """
+    version = MODEL_VERSION or registry.read_active() or BASE_VERSION
+    try:
+        model = load_version(version, backend)
+    except KeyError:
+        if MODEL_VERSION or version == BASE_VERSION:
+            raise
+        logger.error(f"Registry ACTIVE names unusable version {version!r}, serving {BASE_VERSION}")
+        model = load_version(BASE_VERSION, backend)
+    activate(model)
+    logger.info(f" Model version {model.version} active")
     logger.info(f"   LOW_THRESHOLD (suspicious): {LOW_THRESHOLD}")
     logger.info(f"   HIGH_THRESHOLD (malicious): {HIGH_THRESHOLD}")
-    logger.info("=" * 60)
+
+def load_backend(model: LoadedModel = None):
+    """Create the ML_BACKEND runtime for a loaded model (default: the active one) in this process."""
+    model = model or active
+    model.backend_scorer = load_scorer(ML_BACKEND, model.directory, model.digest, DEVICE, TORCH_THREADS)
+    logger.info(f"   Backend: {ML_BACKEND}")
+
+def warm_up(model: LoadedModel) -> float:
+    """Score one small and one full batch per length bucket; returns elapsed ms."""
+    start = time.perf_counter()
+    for length in model.pad_buckets:
+        text = "x" * max(0, length - PAD_MARGIN)
+        for size in (1, SCHED_MAX_BATCH):
+            compute_ae_scores([text] * size, model=model)
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def process_memory() -> dict:
+    """RSS / PSS / shared / private memory of this process in KiB (Linux only, else empty)."""
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.rstrip().endswith("kB")}
+    except OSError:
+        return {}
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "shared_kb": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+async def run_inference(texts: list[str]) -> list[float]:
+    """Score one scheduler batch on the inference executor, entirely with the model active now."""
+    model = active
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        scores = await loop.run_in_executor(inference_executor, partial(compute_ae_scores, texts, model=model))
+    except Exception:
+        model.stats.counters["errors"] += 1
+        raise
+    model.stats.record(time.perf_counter() - start, scores, LOW_THRESHOLD, HIGH_THRESHOLD)
+    shadow.offer(texts, scores, LOW_THRESHOLD, HIGH_THRESHOLD)
+    return scores
+
+# All scoring goes through the scheduler, which forms the forward-pass batches
+batcher = DynamicBatcher(run_inference, SCHED_MAX_BATCH, SCHED_MAX_DELAY_MS / 1000, INFERENCE_THREADS)
+
+# Rescores samples of those batches with the candidate model, in short passes started while the scheduler is idle
+shadow = ShadowScorer(
+    lambda texts, model: compute_ae_scores(texts, model=model), shadow_executor, batcher.wait_idle,
+    SHADOW_SAMPLE_RATE, SHADOW_CPU_BUDGET, SHADOW_MAX_BATCH, threads=TORCH_THREADS, max_pass=SHADOW_MAX_MS / 1000,
+)
+
+score_cache = ScoreCache(SCORE_CACHE_SIZE)
+
+async def score_texts(texts: list[str]) -> list[float]:
+    """Raw ae_scores in input order: cached ones directly, the rest through the scheduler."""
+    keys = [cache_key(t) for t in texts]
+    scores = [score_cache.get(k) for k in keys]
+    missing = {}  # key -> indexes of texts with that key
+    for i, score in enumerate(scores):
+        if score is None:
+            missing.setdefault(keys[i], []).append(i)
+    if missing:
+        digest = model_digest
+        fresh = await batcher.submit_many([texts[idx[0]] for idx in missing.values()])
+        for (key, idx), score in zip(missing.items(), fresh):
+            score_cache.put(key, score, digest)
+            for i in idx:
+                scores[i] = score
+    return scores
+
+swap_lock = asyncio.Lock()
+background_tasks = set()
+
+async def swap_model(version: str, persist: bool = True) -> dict:
+    """
+    Load `version` off the inference threads, warm it up and make it active.
+    Batches already running finish on the model they started with. The
+    previous model stays loaded, so swapping back to it is immediate.
+    persist=True also records the version as the registry's ACTIVE one.
+    """
+    async with swap_lock:
+        if active is not None and version == active.version:
+            return model_loads.setdefault(version, {"status": "active"})
+        loop = asyncio.get_running_loop()
+        status = model_loads[version] = {"status": "loading", "started": time.time()}
+        try:
+            if previous is not None and previous.version == version:
+                model = previous
+            else:
+                model = await loop.run_in_executor(None, load_version, version)
+                status["status"] = "warming"
+                status["warmup_ms"] = await loop.run_in_executor(None, warm_up, model)
+        except Exception as e:
+            status.update(status="failed", error=str(e), finished=time.time())
+            logger.error(f"Loading model version {version} failed: {e}")
+            raise
+        old = active.version if active is not None else None
+        activate(model)
+        if persist:
+            registry.write_active(version)
+        status.update(status="active", digest=model.digest, finished=time.time())
+        logger.info(f"Model version {version} ({model.digest}) active, was {old}")
+        return status
+
+async def load_shadow(version: str) -> dict:
+    """Load and warm up `version` off the inference threads, then shadow it."""
+    loop = asyncio.get_running_loop()
+    status = {"status": "loading", "started": time.time()}
+    try:
+        # The candidate always runs eager: exports are only built for served versions
+        model = await loop.run_in_executor(None, partial(load_version, version, backend=False))
+        status["warmup_ms"] = await loop.run_in_executor(None, warm_up, model)
+    except Exception as e:
+        status.update(status="failed", error=str(e), finished=time.time())
+        logger.error(f"Loading shadow model version {version} failed: {e}")
+        raise
+    shadow.set_model(model)
+    status.update(status="shadowing", digest=model.digest, finished=time.time())
+    logger.info(f"Shadowing model version {version} ({model.digest}) on {shadow.sample_rate:.0%} of requests")
+    return status
+
+def apply_thresholds(thresholds) -> bool:
+    """Classify with (low, high) from now on; False if None or already in use."""
+    global LOW_THRESHOLD, HIGH_THRESHOLD
+    if thresholds is None or thresholds == (LOW_THRESHOLD, HIGH_THRESHOLD):
+        return False
+    LOW_THRESHOLD, HIGH_THRESHOLD = thresholds
+    return True
+
+async def follow_registry():
+    """
+    Apply THRESHOLDS and (unless MODEL_VERSION pins one) swap to the ACTIVE
+    version when they change, e.g. through another serve.py worker.
+    """
+    failed = None
+    while True:
+        await asyncio.sleep(MODEL_POLL_INTERVAL)
+        if apply_thresholds(registry.read_thresholds()):
+            logger.info(f"Thresholds changed to {LOW_THRESHOLD}/{HIGH_THRESHOLD}")
+        if MODEL_VERSION:
+            continue
+        version = registry.read_active()
+        if not version or version == active.version or version == failed or swap_lock.locked():
+            continue
+        try:
+            await swap_model(version, persist=False)
+            failed = None
+        except Exception:
+            failed = version  # retried once ACTIVE names another version
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+def _background_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled():
+        task.exception()  # failures are logged where they happen
 
 @app.on_event("startup")
 async def startup_event():
-    """Load model when server starts."""
-    load_model()
+    """Load model (unless serve.py already did) and start the batching scheduler."""
+    if ae_model is None:
+        load_model()
+    # Not in load_model: serve.py restarts workers from the parent's state at fork time
+    apply_thresholds(registry.read_thresholds())
+    batcher.start()
+    run_in_background(shadow.run())
+    if SHADOW_VERSION:
+        run_in_background(load_shadow(SHADOW_VERSION))
+    if MODEL_POLL_INTERVAL > 0:
+        run_in_background(follow_registry())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in list(background_tasks):
+        task.cancel()
+    await batcher.stop()
+    inference_executor.shutdown(wait=True)
+    shadow_executor.shutdown(wait=True)
+
+
+def encode_text(text: str, model: LoadedModel = None) -> torch.Tensor:
+    """Convert text to tensor of character indices."""
+    model = model or active
+    ids = model.char_encoder.encode_into([text], np.empty((1, model.max_len), dtype=np.int64))
+    return torch.from_numpy(ids[0])
 
+def pad_length(n_chars: int, model: LoadedModel = None) -> int:
+    """
+    Smallest bucket that scores a text of n_chars exactly as max_len padding.
+    
+    Positions >= n + 4 of the pooled encoder output only see padding and
+    equal the max_len case, as long as one of them is not affected by the
+    right-edge zero padding (needs length >= n + 7). The decoder repeats one
+    latent vector, so its outputs on the text positions (< n) are unchanged
+    too. Texts too long for any bucket use max_len.
+    """
+    model = model or active
+    need = min(n_chars, model.max_len) + PAD_MARGIN
+    for b in model.pad_buckets:
+        if b >= need:
+            return b
+    return model.max_len
+
+def encode_batch(texts: list[str], length: int, model: LoadedModel = None) -> torch.Tensor:
+    """
+    Encode texts into one [B, length] tensor of character indices. The tensor
+    shares this thread's reusable encoding buffer: finish with it before the
+    next encode_batch call on the same thread.
+    """
+    return torch.from_numpy((model or active).char_encoder.encode_batch(texts, length))
 
-def encode_text(text: str) -> torch.Tensor:
-    """Convert text to tensor of character indices."""
-    text = "" if text is None else str(text)
-    ids = [stoi.get(ch, unk_id) for ch in text[:max_len]]
-    if len(ids) < max_len:
-        ids += [pad_id] * (max_len - len(ids))
-    return torch.tensor(ids, dtype=torch.long)
+def model_tag() -> str:
+    """
+    Identify everything a /predict score depends on: the loaded artifacts and
+    the thresholds used by score_to_probability. Clients caching scores drop
+    their cache when this changes.
+    """
+    return f"{model_digest}:{LOW_THRESHOLD}:{HIGH_THRESHOLD}"
 
 def build_text(url: str, method: str = "GET") -> str:
     """
@@ -214,21 +639,64 @@ def build_text(url: str, method: str = "GET") -> str:
     return f"METHOD={method} | PATH={path_query}"
 
 @torch.no_grad()
-def compute_ae_score(text: str) -> float:
+def compute_ae_score(text: str, model: LoadedModel = None) -> float:
     """
     Compute the Autoencoder reconstruction error for a given text.
     
     Higher scores indicate more anomalous (potentially malicious) inputs.
     The score represents the average per-character reconstruction loss.
     """
-    x_ids = encode_text(text).unsqueeze(0).to(DEVICE)
-    logits, _ = ae_model(x_ids)
-    loss_pos = ce_tok(logits, x_ids)
-    mask = (x_ids != pad_id).float()
+    model = model or active
+    x_ids = encode_text(text, model).unsqueeze(0).to(DEVICE)
+    logits, _ = model.ae_model(x_ids)
+    loss_pos = model.ce_tok(logits, x_ids)
+    mask = (x_ids != model.pad_id).float()
     denom = mask.sum(dim=1).clamp(min=1.0)
     score = ((loss_pos * mask).sum(dim=1) / denom).item()
     return float(score)
 
+@torch.no_grad()
+def forward_rows(x_ids: torch.Tensor, model: LoadedModel = None) -> torch.Tensor:
+    """Masked mean per-character loss of each row, via a full forward pass."""
+    model = model or active
+    logits, _ = model.ae_model(x_ids)
+    loss_pos = model.ce_tok(logits, x_ids)
+    mask = (x_ids != model.pad_id).float()
+    denom = mask.sum(dim=1).clamp(min=1.0)
+    return (loss_pos * mask).sum(dim=1) / denom
+
+@torch.no_grad()
+def compute_ae_scores(texts: list[str], collapsed: bool = None, scorer=None, model: LoadedModel = None) -> list[float]:
+    """
+    Batched compute_ae_score: texts are grouped by length bucket, each group
+    is encoded into one [B, bucket] tensor and scored in one pass. Scores
+    come back in input order and match the fixed max_len path.
+    
+    Groups go through `scorer` (default: the model's ML_BACKEND export) or,
+    when running eager or when `collapsed` is given, through the collapsed
+    decoder or the full forward pass (see COLLAPSED_DECODER). `model`
+    defaults to the active one.
+    """
+    model = model or active
+    if scorer is None and collapsed is None:
+        scorer = model.backend_scorer
+    collapsed = COLLAPSED_DECODER if collapsed is None else collapsed
+    groups = {}
+    for i, text in enumerate(texts):
+        n = len("" if text is None else str(text))
+        groups.setdefault(pad_length(n, model), []).append(i)
+    
+    scores = [0.0] * len(texts)
+    for length, indexes in groups.items():
+        x_ids = encode_batch([texts[i] for i in indexes], length, model).to(DEVICE)
+        if scorer is not None:
+            rows = scorer(x_ids)
+        else:
+            rows = score_rows(model.ae_model, x_ids, model.pad_id) if collapsed else forward_rows(x_ids, model)
+        for i, score in zip(indexes, rows.tolist()):
+            scores[i] = float(score)
+    return scores
+
 def classify_score(score: float) -> tuple[str, bool, str]:
     """
     Classify a score using two-stage thresholds.
@@ -265,9 +733,15 @@ def score_to_probability(ae_score: float) -> float:
         return min(0.85 + (ae_score - HIGH_THRESHOLD) / 5.0 * 0.15, 1.0)  # 0.85-1.0
 
 def predict_url(url: str, method: str = "GET") -> dict:
-    """Make a prediction for a single URL."""
-    text = build_text(url, method)
-    ae_score = compute_ae_score(text)
+    """Make a prediction for a single URL (synchronously, outside the scheduler)."""
+    return prediction_result(url, compute_ae_score(build_text(url, method)))
+
+async def predict_url_batched(url: str, method: str = "GET") -> dict:
+    """Make a prediction for a single URL through the score cache and batching scheduler."""
+    return prediction_result(url, (await score_texts([build_text(url, method)]))[0])
+
+def prediction_result(url: str, ae_score: float) -> dict:
+    """Build the prediction response fields from a raw ae_score."""
     classification, is_malicious, confidence = classify_score(ae_score)
     prob_score = score_to_probability(ae_score)
     
@@ -305,7 +779,20 @@ async def health():
         "model_type": "CharAutoencoder",
         "device": str(DEVICE),
         "vocab_size": vocab_size,
-        "max_len": max_len
+        "max_len": max_len,
+        "length_buckets": pad_buckets,
+        "backend": ML_BACKEND,
+        "precision": MODEL_PRECISION,
+        "model_tag": model_tag(),
+        "model_version": active.version if active is not None else None,
+        "shadow_version": shadow.model.version if shadow.model is not None else None,
+        "score_cache": score_cache.stats(),
+        "worker": {"id": worker_id, "pid": os.getpid(), "memory": process_memory()},
+        "threads": {
+            "inference": INFERENCE_THREADS,
+            "torch": TORCH_THREADS,
+            "torch_interop": TORCH_INTEROP_THREADS
+        }
     }
 
 @app.post("/predict")
@@ -320,10 +807,29 @@ async def predict(request: ProxyRequest):
     url = raw.get("url", "/")
     method = raw.get("method", "GET")
     
-    result = predict_url(url, method)
+    result = await predict_url_batched(url, method)
     
     # Return proxy-compatible format
-    return {"score": result["score"]}
+    return {"score": result["score"], "model_tag": model_tag()}
+
+@app.post("/predict/batch")
+async def predict_batch(request: BatchProxyRequest):
+    """
+    Score many proxy raw_request payloads at once.
+    
+    Returns proxy-compatible 0-1 scores in request order. At most
+    MAX_BATCH_SIZE requests per call.
+    """
+    if len(request.requests) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE})")
+    
+    texts = [build_text(raw.get("url", "/"), raw.get("method", "GET")) for raw in request.requests]
+    ae_scores = await score_texts(texts)
+    
+    return {
+        "scores": [round(score_to_probability(s), 4) for s in ae_scores],
+        "model_tag": model_tag()
+    }
 
 @app.post("/predict/url", response_model=PredictionResponse)
 async def predict_single(request: URLRequest):
@@ -338,15 +844,21 @@ async def predict_single(request: URLRequest):
     }
     ```
     """
-    result = predict_url(request.url, request.method)
+    result = await predict_url_batched(request.url, request.method)
     return PredictionResponse(**result)
 
+@app.get("/metrics")
+async def metrics():
+    """Batching scheduler metrics: queue depth, batch-size histogram, queue wait."""
+    return {"batcher": batcher.stats()}
+
 @app.get("/config")
 async def get_config():
     """Get current threshold configuration."""
     return {
         "low_threshold": LOW_THRESHOLD,
         "high_threshold": HIGH_THRESHOLD,
+        "model_tag": model_tag(),
         "description": {
             "BENIGN": f"ae_score < {LOW_THRESHOLD}",
             "SUSPICIOUS": f"{LOW_THRESHOLD} <= ae_score < {HIGH_THRESHOLD}",
@@ -359,18 +871,120 @@ async def update_config(config: ThresholdConfig):
     """
     Update threshold configuration on the fly.
     
-    Use this to tune sensitivity without restarting the server.
+    Use this to tune sensitivity without restarting the server. The
+    thresholds are saved in the registry's THRESHOLDS file, which the other
+    serve.py workers follow.
     """
-    global LOW_THRESHOLD, HIGH_THRESHOLD
-    LOW_THRESHOLD = config.low_threshold
-    HIGH_THRESHOLD = config.high_threshold
-    
+    if worker_count > 1 and MODEL_POLL_INTERVAL <= 0:
+        raise HTTPException(status_code=409, detail="Workers do not follow the registry (MODEL_POLL_INTERVAL=0), "
+                                                    "so thresholds would change in this worker only")
+    try:
+        registry.write_thresholds(config.low_threshold, config.high_threshold)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"Could not save thresholds: {e}")
+    apply_thresholds((config.low_threshold, config.high_threshold))
+
     return {
         "status": "updated",
         "low_threshold": LOW_THRESHOLD,
-        "high_threshold": HIGH_THRESHOLD
+        "high_threshold": HIGH_THRESHOLD,
+        "model_tag": model_tag()
     }
 
 
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Check the bearer token when ML_ADMIN_TOKEN is set."""
+    if ML_ADMIN_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {ML_ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Admin token required")
+
+def model_summary(model: Optional[LoadedModel]) -> Optional[dict]:
+    if model is None:
+        return None
+    return {"version": model.version, "digest": model.digest, "path": model.directory, "loaded_at": model.loaded_at}
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+async def list_models():
+    """Registry versions, the active and rollback models, load status and per-version stats."""
+    return {
+        "active": model_summary(active),
+        "previous": model_summary(previous),
+        "versions": registry.versions(),
+        "loads": model_loads,
+        "stats": {version: stats.stats() for version, stats in version_stats.items()},
+    }
+
+@app.post("/admin/models/rollback", dependencies=[Depends(require_admin)])
+async def rollback_model():
+    """Swap back to the previously active model (still loaded, so immediate)."""
+    if previous is None:
+        raise HTTPException(status_code=409, detail="No previous model to roll back to")
+    try:
+        status = await swap_model(previous.version)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"active": model_summary(active), "previous": model_summary(previous), "load": status}
+
+@app.post("/admin/models/{version}/activate", status_code=202, dependencies=[Depends(require_admin)])
+async def activate_model(version: str, wait: bool = False):
+    """
+    Load, warm up and atomically activate a registry version in the
+    background (poll GET /admin/models), or before responding with wait=true.
+    """
+    try:
+        registry.path(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    task = run_in_background(swap_model(version))
+    if not wait:
+        return {"status": "loading", "version": version}
+    try:
+        status = await task
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"active": model_summary(active), "previous": model_summary(previous), "load": status}
+
+
+@app.get("/admin/shadow", dependencies=[Depends(require_admin)])
+async def shadow_report():
+    """
+    Candidate vs active model on the sampled traffic: BENIGN / SUSPICIOUS /
+    MALICIOUS agreement matrix (primary band -> candidate band), ae_score
+    deltas per primary band, and sampled / dropped / over-budget counts.
+    """
+    return {
+        "active": model_summary(active),
+        "candidate": model_summary(shadow.model),
+        "sample_rate": shadow.sample_rate,
+        "cpu_budget": shadow.budget.fraction,
+        "pass_size": shadow.pass_size,
+        "thresholds": {"low": LOW_THRESHOLD, "high": HIGH_THRESHOLD},
+        **shadow.stats.stats(),
+    }
+
+@app.post("/admin/shadow/{version}", dependencies=[Depends(require_admin)])
+async def start_shadow(version: str, sample_rate: Optional[float] = None):
+    """Load a registry version as the shadow candidate (replacing any other); stats start over."""
+    try:
+        registry.path(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    if sample_rate is not None:
+        if not 0.0 <= sample_rate <= 1.0:
+            raise HTTPException(status_code=422, detail="sample_rate must be between 0 and 1")
+        shadow.sample_rate = sample_rate
+    try:
+        status = await load_shadow(version)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"candidate": model_summary(shadow.model), "sample_rate": shadow.sample_rate, "load": status}
+
+@app.delete("/admin/shadow", dependencies=[Depends(require_admin)])
+async def stop_shadow():
+    """Stop shadowing and unload the candidate."""
+    candidate = model_summary(shadow.model)
+    shadow.set_model(None)
+    return {"stopped": candidate}
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=9000)
@@ -0,0 +1,94 @@
+"""
+Selectable inference backends for the autoencoder scoring head.
+
+    eager         PyTorch modules in this process (score_rows / forward_rows)
+    torchscript   ScoringHead traced by export_model.py, run by the TorchScript runtime
+    onnxruntime   ScoringHead exported to ONNX, run by ONNX Runtime on the CPU
+
+Exported backends read the files export_model.py writes next to the model
+artifacts. The export metadata records the model_digest each export was
+built from, and loading refuses an export made for different weights or
+vocabulary. onnxruntime is an optional dependency, only imported when
+selected.
+"""
+
+import json
+import os
+import warnings
+
+import torch
+
+BACKENDS = ("eager", "torchscript", "onnxruntime")
+
+# Exported scoring head per backend, relative to the artifacts directory
+EXPORT_FILES = {
+    "torchscript": "char_ae_scorer.ts",
+    "onnxruntime": "char_ae_scorer.onnx",
+}
+EXPORT_META = "char_ae_scorer.json"
+
+
+def read_export_meta(artifacts_dir: str) -> dict:
+    path = os.path.join(artifacts_dir, EXPORT_META)
+    if not os.path.exists(path):
+        return {"exports": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_export(artifacts_dir: str, backend: str, model_digest: str) -> str:
+    """Path of the backend's export, if it exists and was built from model_digest."""
+    path = os.path.join(artifacts_dir, EXPORT_FILES[backend])
+    export = read_export_meta(artifacts_dir)["exports"].get(backend)
+    if export is None or not os.path.exists(path):
+        raise FileNotFoundError(f"{backend} export not found in {artifacts_dir} (run python export_model.py)")
+    if export["model_digest"] != model_digest:
+        raise RuntimeError(
+            f"{backend} export was built for model {export['model_digest']}, "
+            f"loaded model is {model_digest} (rerun python export_model.py)"
+        )
+    return path
+
+
+class TorchScriptScorer:
+    """x_ids [B, L] -> ae_score [B] through the exported TorchScript module."""
+
+    def __init__(self, path: str, device: torch.device):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)  # torch.jit deprecation notice
+            self.module = torch.jit.load(path, map_location=device)
+        self.module.eval()
+
+    @torch.no_grad()
+    def __call__(self, x_ids: torch.Tensor) -> torch.Tensor:
+        return self.module(x_ids)
+
+
+class OnnxScorer:
+    """x_ids [B, L] -> ae_score [B] through an ONNX Runtime CPU session."""
+
+    def __init__(self, path: str, threads: int):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("ML_BACKEND=onnxruntime needs the onnxruntime package (pip install onnxruntime)") from e
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, x_ids: torch.Tensor) -> torch.Tensor:
+        scores = self.session.run(None, {"x_ids": x_ids.cpu().numpy()})[0]
+        return torch.from_numpy(scores)
+
+
+def load_scorer(backend: str, artifacts_dir: str, model_digest: str, device: torch.device, threads: int = 1):
+    """Scorer callable for an exported backend; None for eager."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown ML_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}")
+    if backend == "eager":
+        return None
+    path = check_export(artifacts_dir, backend, model_digest)
+    if backend == "torchscript":
+        return TorchScriptScorer(path, device)
+    return OnnxScorer(path, threads)
@@ -0,0 +1,157 @@
+"""
+Dynamic batching scheduler for autoencoder inference.
+
+Handlers submit texts and await their scores; they never call the model
+directly. A single scheduler task takes the oldest queued item, then keeps
+collecting until the batch holds max_batch items or the oldest item has
+waited max_delay seconds, and runs one forward pass for the whole batch.
+Under light load a request waits at most max_delay; under heavy load the
+queue fills while a batch runs, so batches grow with the request rate.
+
+Up to concurrency batches run at the same time (one per inference thread);
+the next batch is only formed once a slot is free, so it keeps growing while
+every thread is busy. Background work (shadow scoring) waits on wait_idle(),
+which wakes as soon as the last running batch finishes with nothing queued.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+
+class DynamicBatcher:
+    """Queue + scheduler turning independent score requests into batched forward passes."""
+
+    def __init__(self, run_batch, max_batch: int = 32, max_delay: float = 0.002, concurrency: int = 1):
+        """run_batch(list of texts) -> list of scores, awaitable."""
+        self._run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self.concurrency = max(1, concurrency)
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._running = set()
+        self._forming = False  # a batch is being collected
+        self._idle = asyncio.Event()  # set when the last batch finished with nothing queued, cleared on submit
+        self._idle.set()
+        self._task = None
+        self._waits = deque(maxlen=1024)  # recent queue waits, seconds
+        self.histogram = {}  # "<=N" -> batches whose size falls in that bucket
+        self.counters = {"requests": 0, "batches": 0, "errors": 0, "max_wait_ms": 0.0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+
+    def idle(self) -> bool:
+        """True when no request is queued, being batched or scored."""
+        return not self._forming and not self._running and self._queue.empty()
+
+    async def wait_idle(self):
+        """Return once idle() is True, without polling."""
+        while not self.idle():
+            self._idle.clear()
+            await self._idle.wait()
+
+    async def submit(self, text: str) -> float:
+        future = asyncio.get_running_loop().create_future()
+        self._idle.clear()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    async def submit_many(self, texts: list) -> list:
+        return list(await asyncio.gather(*(self.submit(t) for t in texts)))
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        self._forming = True
+        deadline = batch[0][2] + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._next_batch()
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            finally:
+                self._forming = False
+            task = asyncio.create_task(self._execute(batch))
+            self._running.add(task)
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task):
+        self._running.discard(task)
+        self._slots.release()
+        if self.idle():
+            self._idle.set()
+
+    async def _execute(self, batch: list):
+        started = time.perf_counter()
+        for _, _, enqueued in batch:
+            self._waits.append(started - enqueued)
+        self._record(len(batch), started - batch[0][2])
+        try:
+            scores = await self._run_batch([text for text, _, _ in batch])
+        except Exception as e:
+            self.counters["errors"] += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), score in zip(batch, scores):
+            if not future.done():
+                future.set_result(score)
+
+    def _record(self, size: int, oldest_wait: float):
+        c = self.counters
+        c["requests"] += size
+        c["batches"] += 1
+        c["max_wait_ms"] = max(c["max_wait_ms"], oldest_wait * 1000)
+        bound = 1
+        while bound < size:
+            bound *= 2
+        key = f"<={bound}"
+        self.histogram[key] = self.histogram.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        c = self.counters
+        waits = sorted(self._waits)
+        pct = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 3) if waits else 0.0
+        return {
+            **c,
+            "queue_depth": self._queue.qsize(),
+            "running_batches": len(self._running),
+            "avg_batch": round(c["requests"] / c["batches"], 2) if c["batches"] else 0.0,
+            "batch_size_histogram": dict(sorted(self.histogram.items(), key=lambda kv: int(kv[0][2:]))),
+            "wait_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)},
+            "max_batch": self.max_batch,
+            "max_delay_ms": self.max_delay * 1000,
+            "concurrency": self.concurrency,
+        }
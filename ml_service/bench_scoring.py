@@ -0,0 +1,79 @@
+"""
+Scoring-path benchmark for ml_service.
+
+Times one batch of typical requests through each way of computing ae_score:
+
+    reference    compute_ae_score() per text, padded to max_len
+    full-256     one batched forward pass, padded to max_len
+    bucketed     length-bucketed padding, full forward pass
+    collapsed    length-bucketed padding, collapsed decoder (the default)
+
+plus the exported torchscript / onnxruntime backends when export_model.py
+has written them.
+
+Usage (from ml_service/):
+    python bench_scoring.py [--batch-sizes 1,8,32] [--repeat 20]
+"""
+
+import argparse
+import copy
+import logging
+import time
+
+import app
+from backends import EXPORT_FILES, load_scorer
+from bench_threads import sample_paths
+
+
+def full_256(texts):
+    model = copy.copy(app.active)
+    model.pad_buckets = [model.max_len]
+    return app.compute_ae_scores(texts, collapsed=False, model=model)
+
+
+# Scoring paths compared by this benchmark: name -> fn(list of texts)
+PATHS = {
+    "reference": lambda texts: [app.compute_ae_score(t) for t in texts],
+    "full-256": full_256,
+    "bucketed": lambda texts: app.compute_ae_scores(texts, collapsed=False),
+    "collapsed": lambda texts: app.compute_ae_scores(texts, collapsed=True),
+}
+
+
+def per_batch_ms(fn, texts, repeat: int) -> float:
+    fn(texts)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(texts)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    app.load_model()
+    paths = dict(PATHS)
+    for backend in EXPORT_FILES:
+        try:
+            scorer = load_scorer(backend, app.active.directory, app.model_digest, app.DEVICE, app.TORCH_THREADS)
+        except (FileNotFoundError, ImportError):
+            continue
+        paths[backend] = lambda texts, scorer=scorer: app.compute_ae_scores(texts, scorer=scorer)
+
+    header = f"{'batch':>6}" + "".join(f" {name:>11}" for name in paths) + "   (ms per batch)"
+    print(header)
+    print("-" * len(header))
+    for size in [int(b) for b in args.batch_sizes.split(",")]:
+        texts = [app.build_text(p) for p in sample_paths(size)]
+        row = f"{size:>6}"
+        for fn in paths.values():
+            row += f" {per_batch_ms(fn, texts, args.repeat):>11.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
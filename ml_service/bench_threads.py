@@ -0,0 +1,122 @@
+"""
+Inference thread-layout benchmark for ml_service.
+
+Each layout INFERENCExTORCH (inference threads x torch intra-op threads) runs
+in its own process, because torch's inter-op pool can only be configured
+once per process. The worker loads the model, drives the batching scheduler
+with a fixed number of concurrent clients and, at the same time, measures how
+late a 1 ms ticker on the event loop wakes up. That lag is what /health and
+/config experience under saturation.
+
+Usage (from ml_service/):
+    python bench_threads.py [--layouts 1x1,1x2,2x1,4x1] [--requests 2000] [--concurrency 64]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+TEXT_PATHS = [
+    "/",
+    "/rest/products/search?q=apple",
+    "/api/Products/1",
+    "/assets/public/images/products/apple_juice.jpg",
+    "/rest/products/search?q=1 union select id,email from users--",
+    "/ftp/../../etc/passwd",
+    "/api/Feedbacks/?comment=<img src=x onerror=alert(1)>",
+]
+
+
+def sample_paths(n: int):
+    """n distinct request paths (unique query suffix) cycling through TEXT_PATHS."""
+    for i in range(n):
+        path = TEXT_PATHS[i % len(TEXT_PATHS)]
+        yield f"{path}{'&' if '?' in path else '?'}n={i}"
+
+
+async def drive(requests: int, concurrency: int) -> dict:
+    import app
+
+    app.load_model()
+    app.batcher.start()
+    texts = [app.build_text(path) for path in sample_paths(requests)]
+
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    latencies = []
+    queue = list(texts)
+
+    async def client():
+        while queue:
+            text = queue.pop()
+            start = time.perf_counter()
+            await app.batcher.submit(text)
+            latencies.append(time.perf_counter() - start)
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+    await app.batcher.stop()
+    app.inference_executor.shutdown(wait=True)
+
+    latencies.sort()
+    lags.sort()
+    pct = lambda xs, q: xs[min(len(xs) - 1, int(q * len(xs)))] * 1000 if xs else 0.0
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": pct(latencies, 0.5),
+        "p99_ms": pct(latencies, 0.99),
+        "loop_lag_p99_ms": pct(lags, 0.99),
+        "avg_batch": app.batcher.stats()["avg_batch"],
+    }
+
+
+def run_layout(layout: str, args) -> dict:
+    inference, torch_threads = layout.split("x")
+    env = dict(os.environ, INFERENCE_THREADS=inference, TORCH_THREADS=torch_threads)
+    out = subprocess.run(
+        [sys.executable, __file__, "--worker", "--requests", str(args.requests), "--concurrency", str(args.concurrency)],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layouts", default="1x1,1x2,2x1,4x1", help="comma-separated INFERENCExTORCH thread layouts")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        import logging
+        logging.disable(logging.INFO)
+        print(json.dumps(asyncio.run(drive(args.requests, args.concurrency))))
+        return
+
+    print(f"cpus={os.cpu_count()} requests={args.requests} concurrency={args.concurrency}")
+    header = f"{'layout':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'loop lag p99':>13} {'avg batch':>10}"
+    print(header)
+    print("-" * len(header))
+    for layout in args.layouts.split(","):
+        r = run_layout(layout, args)
+        print(f"{layout:>8} {r['rps']:>9.0f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['loop_lag_p99_ms']:>13.2f} {r['avg_batch']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
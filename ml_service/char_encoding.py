@@ -0,0 +1,94 @@
+"""
+Table-driven character encoding for the autoencoder vocabulary.
+
+CharEncoder turns model inputs into id rows without a per-character Python
+loop: a batch of texts is joined into one string, converted to a NumPy array
+of code points in one go (the raw bytes for ASCII/Latin-1 text, UTF-32
+otherwise), mapped through a dense codepoint -> id table and scattered into
+the caller's [B, L] buffer. The table covers every code point up to the
+largest single-character vocabulary entry; one extra slot holds <UNK>, and
+larger code points are clamped onto it.
+
+Batch buffers are reused per thread (see batch_buffer), so steady-state
+encoding allocates no Python lists and no new id buffers.
+"""
+
+import threading
+
+import numpy as np
+
+
+def as_text(text) -> str:
+    """Model input as str: UTF-8 bytes-like objects are decoded, None is empty."""
+    if isinstance(text, str):
+        return text
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        return bytes(text).decode("utf-8", "surrogateescape")
+    return "" if text is None else str(text)
+
+
+class CharEncoder:
+    """Codepoint -> id lookup for one vocabulary (itos list, as in char_vocab.json)."""
+
+    def __init__(self, itos: list, pad_id: int, unk_id: int):
+        self.pad_id = pad_id
+        self.unk_id = unk_id
+        chars = {ch: i for i, ch in enumerate(itos) if len(ch) == 1}
+        size = max([255] + [ord(ch) for ch in chars]) + 1
+        # Slot `size` is the UNK landing spot for code points past the table
+        self.table = np.full(size + 1, unk_id, dtype=np.int64)
+        for ch, i in chars.items():
+            self.table[ord(ch)] = i
+        self._last = size
+        self._local = threading.local()
+
+    def codepoints(self, text) -> np.ndarray:
+        """
+        Table indexes for the characters of text: str, UTF-8 bytes-like, or an
+        integer array of code points.
+        """
+        if isinstance(text, np.ndarray):
+            return text if text.dtype == np.uint8 else np.minimum(text, self._last)
+        text = as_text(text)
+        try:
+            # Fast path: one byte per character, indexes table[:256] directly
+            return np.frombuffer(text.encode("latin-1"), dtype=np.uint8)
+        except UnicodeEncodeError:
+            cps = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+            return np.minimum(cps, self._last)
+
+    def encode_into(self, texts, out: np.ndarray) -> np.ndarray:
+        """Write ids of texts into out [len(texts), L], truncating to L and padding with <PAD>."""
+        length = out.shape[1]
+        out.fill(self.pad_id)
+        if any(isinstance(t, np.ndarray) for t in texts):
+            for row, text in zip(out, texts):
+                cps = self.codepoints(text[:length])
+                np.take(self.table, cps, out=row[:len(cps)])
+            return out
+
+        # One conversion and one table lookup for the whole batch
+        texts = texts if all(type(t) is str for t in texts) else [as_text(t) for t in texts]
+        lengths = np.fromiter((min(len(t), length) for t in texts), dtype=np.int64, count=len(texts))
+        cps = self.codepoints("".join(t[:length] for t in texts))
+        filled = np.arange(length) < lengths[:, None]
+        out[filled] = self.table[cps]
+        return out
+
+    def batch_buffer(self, rows: int, length: int) -> np.ndarray:
+        """
+        Contiguous [rows, length] int64 view of this thread's scratch buffer.
+        The view is overwritten by the next call on the same thread, so the
+        caller must be done with it (and with tensors sharing its memory)
+        before encoding the next batch.
+        """
+        need = rows * length
+        buf = getattr(self._local, "buf", None)
+        if buf is None or buf.size < need:
+            buf = np.empty(max(need, 2 * (0 if buf is None else buf.size)), dtype=np.int64)
+            self._local.buf = buf
+        return buf[:need].reshape(rows, length)
+
+    def encode_batch(self, texts, length: int) -> np.ndarray:
+        """encode_into() on this thread's reusable buffer."""
+        return self.encode_into(texts, self.batch_buffer(len(texts), length))
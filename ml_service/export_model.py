@@ -0,0 +1,92 @@
+"""
+Export the autoencoder scoring head for the torchscript and onnxruntime backends.
+
+Wraps the loaded CharAutoencoder in ScoringHead (model + masked-loss head,
+x_ids [B, L] -> ae_score [B]) and writes, next to the model artifacts:
+
+    char_ae_scorer.ts      TorchScript (traced)
+    char_ae_scorer.onnx    ONNX, dynamic batch and length axes
+    char_ae_scorer.json    model_digest each export was built from
+
+Each export is checked against the eager scores on a sample batch before it
+is written. Rerun after replacing char_ae_best.pt or char_vocab.json; the
+service refuses exports whose digest does not match the loaded model.
+Exporting ONNX needs the onnx package.
+
+Usage (from ml_service/):
+    python export_model.py [--formats torchscript,onnx] [--opset 17]
+"""
+
+import argparse
+import json
+import logging
+import os
+import warnings
+
+import torch
+
+import app
+from ae_scoring import ScoringHead
+from backends import EXPORT_FILES, EXPORT_META, OnnxScorer, TorchScriptScorer, read_export_meta
+from bench_threads import sample_paths
+
+FORMATS = {"torchscript": "torchscript", "onnx": "onnxruntime"}
+
+
+def check(scorer, head, x_ids: torch.Tensor, tolerance: float = 1e-4) -> float:
+    with torch.no_grad():
+        worst = (scorer(x_ids).cpu() - head(x_ids).cpu()).abs().max().item()
+    if worst > tolerance:
+        raise RuntimeError(f"export differs from eager scores by {worst:.2e}")
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", default="torchscript,onnx")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    app.ML_BACKEND = "eager"
+    app.load_model()
+    head = ScoringHead(app.ae_model, app.pad_id).eval()
+
+    texts = [app.build_text(p) for p in sample_paths(16)]
+    example = app.encode_batch(texts, 96).clone().to(app.DEVICE)
+    # A different shape, to catch sizes frozen into the export
+    probe = app.encode_batch(texts[:5], 48).clone().to(app.DEVICE)
+
+    meta = read_export_meta(app.active.directory)
+    for fmt in args.formats.split(","):
+        backend = FORMATS[fmt.strip()]
+        path = os.path.join(app.active.directory, EXPORT_FILES[backend])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            if backend == "torchscript":
+                torch.jit.trace(head, (example,)).save(path)
+                scorer = TorchScriptScorer(path, app.DEVICE)
+            else:
+                torch.onnx.export(
+                    head, (example,), path,
+                    input_names=["x_ids"], output_names=["ae_score"],
+                    dynamic_axes={"x_ids": {0: "batch", 1: "length"}, "ae_score": {0: "batch"}},
+                    opset_version=args.opset, dynamo=False,
+                )
+                scorer = OnnxScorer(path, app.TORCH_THREADS)
+        worst = max(check(scorer, head, example), check(scorer, head, probe))
+        meta["exports"][backend] = {
+            "file": EXPORT_FILES[backend],
+            "model_digest": app.model_digest,
+            "torch": torch.__version__,
+            **({"opset": args.opset} if backend == "onnxruntime" else {}),
+        }
+        print(f"{backend:>12}: {path} (max |diff| vs eager {worst:.2e})")
+
+    with open(os.path.join(app.active.directory, EXPORT_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print("run python verify_parity.py to check the exports against the reference corpus")
+
+
+if __name__ == "__main__":
+    main()
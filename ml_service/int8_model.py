@@ -0,0 +1,67 @@
+"""
+Dynamic int8 quantization of CharAutoencoder for CPU inference.
+
+PyTorch's dynamic quantization only covers Linear layers well: its Conv1d
+variant quantizes activations with a fixed scale and wrecks the scores.
+The encoder convolutions are therefore run as im2col + dynamically quantized
+Linear. Each output position's kernel window is unfolded into one row, and
+fbgemm multiplies the rows with per-channel int8 weights, quantizing the
+activations per batch. enc_fc and dec_fc are quantized as plain Linear
+layers.
+
+The decoder's dec_conv1 and dec_out stay fp32. With the collapsed decoder
+(ae_scoring.py) they only run on a handful of rows per sample, and
+score_rows() reads their weights directly. The embedding stays fp32 too.
+
+quantize_model() is deterministic, so a state dict saved from its output
+loads back into quantize_model(CharAutoencoder(...)) of the same shape.
+"""
+
+import copy
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.ao.nn.quantized.dynamic as nnqd
+from torch.ao.quantization import per_channel_dynamic_qconfig
+
+# Layers replaced by quantize_model()
+QUANTIZED_CONVS = ("enc_conv1", "enc_conv2")
+QUANTIZED_LINEARS = ("enc_fc", "dec_fc")
+
+
+def _dynamic_linear(linear: nn.Linear) -> nn.Module:
+    linear.qconfig = per_channel_dynamic_qconfig
+    return nnqd.Linear.from_float(linear)
+
+
+class QuantizedConv1d(nn.Module):
+    """Conv1d (stride 1, dilation 1, one group) as unfold + dynamically quantized Linear."""
+
+    def __init__(self, conv: nn.Conv1d):
+        super().__init__()
+        self.kernel = conv.kernel_size[0]
+        self.padding = conv.padding[0]
+        self.in_channels = conv.in_channels
+        # Weight [out, in, K] -> [out, K * in], matching the unfolded window layout
+        linear = nn.Linear(conv.in_channels * self.kernel, conv.out_channels)
+        with torch.no_grad():
+            linear.weight.copy_(conv.weight.permute(0, 2, 1).reshape(conv.out_channels, -1))
+            linear.bias.copy_(conv.bias)
+        self.linear = _dynamic_linear(linear)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        batch, channels, length = x.shape
+        windows = F.pad(x, (self.padding, self.padding)).transpose(1, 2).unfold(1, self.kernel, 1)
+        windows = windows.transpose(2, 3).reshape(batch, length, self.kernel * channels)
+        return self.linear(windows).transpose(1, 2)
+
+
+def quantize_model(model: nn.Module) -> nn.Module:
+    """int8 copy of a CharAutoencoder (the original is left untouched)."""
+    q = copy.deepcopy(model).cpu().eval()
+    for name in QUANTIZED_CONVS:
+        setattr(q, name, QuantizedConv1d(getattr(q, name)))
+    for name in QUANTIZED_LINEARS:
+        setattr(q, name, _dynamic_linear(getattr(q, name)))
+    return q
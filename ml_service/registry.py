@@ -0,0 +1,135 @@
+"""
+Versioned model artifacts and per-version serving stats.
+
+Layout (MODEL_REGISTRY_DIR defaults to ae_artifacts/versions):
+
+    ae_artifacts/                      the original flat artifacts, served as version "base"
+    ae_artifacts/versions/<version>/   bundle.json, char_vocab.json, char_ae_best.pt
+                                       (+ optional char_ae_int8.pt and exports)
+    ae_artifacts/versions/ACTIVE       name of the version to serve
+    ae_artifacts/versions/THRESHOLDS   band thresholds last set through POST /config
+
+A version directory is immutable once published: copy the files into a new
+directory, then activate it through the admin API (or by writing ACTIVE,
+which every worker follows). ACTIVE is replaced atomically on every swap so
+restarts and other workers come up on the same version. THRESHOLDS is
+shared the same way, so every worker classifies with the same thresholds.
+"""
+
+import json
+import os
+import re
+import time
+from collections import deque
+
+BASE_VERSION = "base"
+REQUIRED_FILES = ("bundle.json", "char_vocab.json", "char_ae_best.pt")
+ACTIVE_FILE = "ACTIVE"
+THRESHOLDS_FILE = "THRESHOLDS"
+
+_VERSION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+class ModelRegistry:
+    """Maps version names to artifact directories and keeps the ACTIVE pointer."""
+
+    def __init__(self, root: str, base_dir: str):
+        self.root = root
+        self.base_dir = base_dir
+
+    def path(self, version: str) -> str:
+        """Artifact directory of a version; KeyError if it is not a complete version."""
+        if version == BASE_VERSION:
+            directory = self.base_dir
+        elif _VERSION_NAME.match(version) and version not in (ACTIVE_FILE, THRESHOLDS_FILE):
+            directory = os.path.join(self.root, version)
+        else:
+            raise KeyError(f"Invalid model version name: {version!r}")
+        missing = [name for name in REQUIRED_FILES if not os.path.exists(os.path.join(directory, name))]
+        if missing:
+            raise KeyError(f"Model version {version!r} not found or incomplete (missing {', '.join(missing)})")
+        return directory
+
+    def versions(self) -> list:
+        """Every complete version, base first, then by directory name."""
+        names = [BASE_VERSION]
+        if os.path.isdir(self.root):
+            names += sorted(n for n in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, n)))
+        found = []
+        for name in names:
+            try:
+                directory = self.path(name)
+            except KeyError:
+                continue
+            model_file = os.path.join(directory, "char_ae_best.pt")
+            found.append({"version": name, "path": directory, "modified": os.path.getmtime(model_file)})
+        return found
+
+    def read_active(self):
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def write_active(self, version: str):
+        self._replace(ACTIVE_FILE, version + "\n")
+
+    def read_thresholds(self):
+        """(low, high) from THRESHOLDS, or None if it is missing or unreadable."""
+        try:
+            with open(os.path.join(self.root, THRESHOLDS_FILE), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return float(data["low_threshold"]), float(data["high_threshold"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def write_thresholds(self, low: float, high: float):
+        self._replace(THRESHOLDS_FILE, json.dumps({"low_threshold": low, "high_threshold": high}) + "\n")
+
+    def _replace(self, name: str, content: str):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+class VersionStats:
+    """Batch latency and ae_score distribution of one served version."""
+
+    def __init__(self, window: int = 2048):
+        self.since = time.time()
+        self._latencies = deque(maxlen=window)  # seconds per batch
+        self._scores = deque(maxlen=window * 8)
+        self.bands = {"BENIGN": 0, "SUSPICIOUS": 0, "MALICIOUS": 0}
+        self.counters = {"batches": 0, "requests": 0, "errors": 0, "busy_seconds": 0.0}
+
+    def record(self, seconds: float, scores: list, low: float, high: float):
+        c = self.counters
+        c["batches"] += 1
+        c["requests"] += len(scores)
+        c["busy_seconds"] += seconds
+        self._latencies.append(seconds)
+        self._scores.extend(scores)
+        for s in scores:
+            self.bands["MALICIOUS" if s >= high else "SUSPICIOUS" if s >= low else "BENIGN"] += 1
+
+    def stats(self) -> dict:
+        c = self.counters
+        latencies = sorted(self._latencies)
+        scores = sorted(self._scores)
+        pick = lambda xs, q: xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+        return {
+            **c,
+            "busy_seconds": round(c["busy_seconds"], 3),
+            "since": self.since,
+            "batch_ms": {q: round(pick(latencies, p) * 1000, 3) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+            "per_request_us": round(c["busy_seconds"] / c["requests"] * 1e6, 1) if c["requests"] else 0.0,
+            "ae_score": {
+                "mean": round(sum(scores) / len(scores), 4) if scores else 0.0,
+                **{q: round(pick(scores, p), 4) for q, p in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+            },
+            "bands": dict(self.bands),
+        }
@@ -0,0 +1,73 @@
+"""
+In-service cache of raw ae_scores.
+
+Keys are blake2b hashes of the model input (build_text output), values are
+the raw ae_score. Classification and the proxy's 0-1 score are derived from
+it on every response, so threshold changes via /config apply to cached
+entries immediately. An ae_score only depends on the loaded weights and
+vocabulary, so the cache is tied to model_digest: loading a different
+model clears it, and scores computed by the previous model are discarded
+instead of being stored.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+
+def cache_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=16).digest()
+
+
+class ScoreCache:
+    """LRU map from cache_key() to ae_score for one model_digest."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.model_digest = None
+        self._entries = OrderedDict()  # key -> ae_score
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "stale_puts": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: bytes):
+        score = self._entries.get(key)
+        if score is None:
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return score
+
+    def put(self, key: bytes, score: float, digest: str):
+        """Store a score computed by model `digest`; dropped if another model is loaded by now."""
+        if self.max_entries <= 0:
+            return
+        if digest != self.model_digest:
+            self.counters["stale_puts"] += 1
+            return
+        self._entries[key] = score
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def set_model(self, digest: str):
+        """Record the loaded model; a different one invalidates every entry."""
+        if digest == self.model_digest:
+            return
+        if self.model_digest is not None:
+            self.counters["invalidations"] += 1
+        self._entries.clear()
+        self.model_digest = digest
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["hits"] + c["misses"]
+        return {
+            **c,
+            "entries": len(self._entries),
+            "capacity": self.max_entries,
+            "hit_rate": round(c["hits"] / lookups, 4) if lookups else 0.0,
+            "model_digest": self.model_digest,
+        }
@@ -0,0 +1,148 @@
+"""
+Pre-fork multi-worker server for ml_service.
+
+The parent process loads the vocabulary and CharAutoencoder weights once,
+moves the fp32 parameters into shared memory and freezes the garbage
+collector, so the forked workers reuse the same physical pages: the weights
+through the shared mapping, the rest of the loaded state through
+copy-on-write. It then opens one listening socket and forks the workers,
+each running its own uvicorn server, batching scheduler and score cache on
+that socket; the kernel spreads incoming connections across them. Model
+swaps and POST /config thresholds reach every worker through the registry's
+ACTIVE and THRESHOLDS files (see MODEL_POLL_INTERVAL in app.py).
+
+The parent never runs inference: torch and ONNX Runtime thread pools do not
+survive fork(), so every worker creates its own ML_BACKEND runtime after
+forking. Workers that die are restarted. SIGTERM / SIGINT stop all workers
+gracefully.
+
+TORCH_THREADS defaults to cores / (workers * INFERENCE_THREADS). On
+platforms without fork() (Windows) a single worker runs in-process.
+
+Usage (from ml_service/):
+    python serve.py [--workers N] [--host 0.0.0.0] [--port 9000]
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+logger = logging.getLogger("ml_service.serve")
+
+# A worker dying sooner than this after starting is restarted with a delay
+MIN_WORKER_LIFETIME = 5.0
+
+
+def listen(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(worker_id: int, sock: socket.socket, args):
+    """Serve on the inherited socket until uvicorn shuts down (runs in the child)."""
+    import uvicorn
+    import app
+
+    app.worker_id = worker_id
+    app.worker_count = args.workers
+    app.load_backend()
+    config = uvicorn.Config(app.app, log_level=args.log_level, timeout_graceful_shutdown=args.graceful_timeout)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(worker_id: int, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            run_worker(worker_id, sock, args)
+        except BaseException:
+            logger.exception(f"worker {worker_id} failed")
+            code = 1
+        finally:
+            os._exit(code)
+    logger.info(f"worker {worker_id} started (pid {pid})")
+    return pid
+
+
+def supervise(sock: socket.socket, args):
+    children = {}  # pid -> (worker_id, started_at)
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker_id in range(args.workers):
+        children[spawn(worker_id, sock, args)] = (worker_id, time.monotonic())
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id, started = children.pop(pid, (None, 0.0))
+        if worker_id is None or stopping:
+            continue
+        logger.warning(f"worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            time.sleep(1.0)
+        if not stopping:
+            children[spawn(worker_id, sock, args)] = (worker_id, time.monotonic())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("ML_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--host", default=os.getenv("ML_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("ML_PORT", "9000")))
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--graceful-timeout", type=int, default=10)
+    args = parser.parse_args()
+    args.workers = max(1, args.workers)
+    if not hasattr(os, "fork"):
+        args.workers = 1
+
+    # Split the cores between workers before app reads TORCH_THREADS
+    inference_threads = max(1, int(os.getenv("INFERENCE_THREADS", "1")))
+    os.environ.setdefault("TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // (args.workers * inference_threads))))
+
+    import app
+
+    app.load_model(backend=False)
+    # fp32 parameters move to shared memory; the int8 packed weights stay copy-on-write
+    app.ae_model.share_memory()
+    sock = listen(args.host, args.port)
+    logger.info(f"ml_service listening on {args.host}:{args.port} with {args.workers} worker(s)")
+
+    if args.workers == 1:
+        run_worker(0, sock, args)
+        return
+
+    # Keep the collector from writing to (and so un-sharing) pages of objects loaded so far
+    gc.freeze()
+    supervise(sock, args)
+    sock.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
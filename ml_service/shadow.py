@@ -0,0 +1,199 @@
+"""
+Shadow scoring of a candidate model on live traffic.
+
+The scheduler hands every scored batch to ShadowScorer.offer(), which keeps
+a sample of its texts together with the primary model's scores. A
+background task rescores each sample with the candidate model on its own
+thread and records how the candidate's ae_scores and bands differ from the
+primary's. Verdicts always come from the primary and responses never wait
+for the candidate. Shadow passes still share the CPU with primary batches
+that arrive while one runs, so they are kept small and rare:
+
+    - a pass only starts once the batching scheduler reports idle (no batch
+      queued or running); the scorer sleeps on that event, it does not poll
+    - a pass scores at most max_batch texts, and fewer while passes take
+      longer than max_pass seconds: the pass size halves after every long
+      pass and grows back by one text after every short one
+    - a CpuBudget caps shadow work at a fraction of one core; samples over
+      budget are skipped, never delayed
+    - at most max_pending chunks wait, the oldest are dropped first
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+logger = logging.getLogger("ml_service.shadow")
+
+BANDS = ("BENIGN", "SUSPICIOUS", "MALICIOUS")
+
+
+def band(score: float, low: float, high: float) -> str:
+    return "MALICIOUS" if score >= high else "SUSPICIOUS" if score >= low else "BENIGN"
+
+
+class CpuBudget:
+    """
+    Token bucket of CPU seconds, refilled at `fraction` of one core and
+    holding at most `burst` seconds of refill. A batch that overruns leaves
+    the bucket in debt, so the long-run average never exceeds `fraction`.
+    """
+
+    def __init__(self, fraction: float, burst: float = 1.0):
+        self.fraction = max(0.0, fraction)
+        self.capacity = self.fraction * burst
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.fraction)
+        self._updated = now
+
+    def available(self) -> bool:
+        self._refill()
+        return self.tokens > 0
+
+    def charge(self, seconds: float):
+        self._refill()
+        self.tokens -= seconds
+
+
+class ShadowStats:
+    """Band agreement matrix and score deltas (candidate - primary) of one candidate."""
+
+    def __init__(self, window: int = 8192):
+        self.since = time.time()
+        self.matrix = {p: {c: 0 for c in BANDS} for p in BANDS}  # primary band -> candidate band -> count
+        self._deltas = {b: deque(maxlen=window) for b in BANDS}  # by primary band
+        self.counters = {"sampled": 0, "scored": 0, "dropped": 0, "over_budget": 0, "errors": 0,
+                         "batches": 0, "long_passes": 0,
+                         "cpu_seconds": 0.0}
+
+    def record(self, primary: list, candidate: list, low: float, high: float):
+        for p, c in zip(primary, candidate):
+            primary_band = band(p, low, high)
+            self.matrix[primary_band][band(c, low, high)] += 1
+            self._deltas[primary_band].append(c - p)
+        self.counters["scored"] += len(primary)
+        self.counters["batches"] += 1
+
+    @staticmethod
+    def _summary(deltas: list) -> dict:
+        deltas = sorted(deltas)
+        pick = lambda q: round(deltas[min(len(deltas) - 1, int(q * len(deltas)))], 4) if deltas else 0.0
+        return {
+            "count": len(deltas),
+            "mean": round(sum(deltas) / len(deltas), 4) if deltas else 0.0,
+            "mean_abs": round(sum(abs(d) for d in deltas) / len(deltas), 4) if deltas else 0.0,
+            "p05": pick(0.05), "p50": pick(0.5), "p95": pick(0.95),
+        }
+
+    def stats(self) -> dict:
+        c = self.counters
+        compared = sum(sum(row.values()) for row in self.matrix.values())
+        agreed = sum(self.matrix[b][b] for b in BANDS)
+        every = [d for b in BANDS for d in self._deltas[b]]
+        return {
+            **c,
+            "cpu_seconds": round(c["cpu_seconds"], 3),
+            "since": self.since,
+            "band_agreement": round(agreed / compared, 4) if compared else None,
+            "agreement_matrix": {p: dict(row) for p, row in self.matrix.items()},
+            "score_delta": {"ALL": self._summary(every), **{b: self._summary(self._deltas[b]) for b in BANDS}},
+        }
+
+
+class ShadowScorer:
+    """Samples scheduler batches and scores them with a candidate model in the background."""
+
+    def __init__(self, score, executor, wait_idle, sample_rate: float, cpu_budget: float,
+                 max_batch: int = 8, max_pending: int = 64, threads: int = 1, max_pass: float = 0.005):
+        """
+        score(texts, model) -> candidate scores, run on `executor`; awaiting
+        wait_idle() returns once the primary scheduler has no work. Shadow
+        batches are charged wall time x `threads` (the intra-op threads they
+        may occupy).
+        """
+        self._score = score
+        self._executor = executor
+        self._wait_idle = wait_idle
+        self.sample_rate = sample_rate
+        self.budget = CpuBudget(cpu_budget)
+        self.max_batch = max(1, max_batch)
+        self.max_pass = max_pass
+        self.pass_size = self.max_batch  # texts per pass, adapted to max_pass
+        self.threads = max(1, threads)
+        self.model = None
+        self.stats = ShadowStats()
+        self._pending = deque(maxlen=max(1, max_pending))  # (texts, primary scores, low, high)
+        self._wakeup = asyncio.Event()
+        self._rng = random.Random()
+
+    def set_model(self, model):
+        """Shadow `model` from now on (None stops shadowing); stats start over."""
+        self.model = model
+        self.stats = ShadowStats()
+        self._pending.clear()
+
+    def offer(self, texts: list, scores: list, low: float, high: float):
+        """Queue a sample of a batch the primary model just scored."""
+        if self.model is None or self.sample_rate <= 0:
+            return
+        picked = [i for i in range(len(texts)) if self._rng.random() < self.sample_rate]
+        counters = self.stats.counters
+        counters["sampled"] += len(picked)
+        for start in range(0, len(picked), self.max_batch):
+            chunk = picked[start:start + self.max_batch]
+            if len(self._pending) == self._pending.maxlen:
+                counters["dropped"] += len(self._pending[0][0])
+            self._pending.append(([texts[i] for i in chunk], [scores[i] for i in chunk], low, high))
+        if picked:
+            self._wakeup.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._wait_idle()
+            if not self._pending:  # cleared by set_model() meanwhile
+                continue
+            texts, primary, low, high = self._take()
+            model, stats = self.model, self.stats
+            if not self.budget.available():
+                stats.counters["over_budget"] += len(texts)
+                continue
+            start = time.perf_counter()
+            try:
+                scores = await loop.run_in_executor(self._executor, self._score, texts, model)
+            except Exception as e:
+                stats.counters["errors"] += len(texts)
+                logger.warning(f"Shadow scoring with {model.version} failed: {e}")
+                continue
+            finally:
+                elapsed = time.perf_counter() - start
+                self.budget.charge(elapsed * self.threads)
+                stats.counters["cpu_seconds"] += elapsed * self.threads
+                self._adapt(elapsed, stats)
+            stats.record(primary, scores, low, high)
+
+    def _take(self) -> tuple:
+        """The next pass: up to pass_size texts of the oldest chunk, leaving the rest queued."""
+        texts, primary, low, high = self._pending[0]
+        if len(texts) <= self.pass_size:
+            return self._pending.popleft()
+        n = self.pass_size
+        self._pending[0] = (texts[n:], primary[n:], low, high)
+        return texts[:n], primary[:n], low, high
+
+    def _adapt(self, elapsed: float, stats: ShadowStats):
+        if elapsed > self.max_pass:
+            stats.counters["long_passes"] += 1
+            self.pass_size = max(1, self.pass_size // 2)
+        elif elapsed < self.max_pass / 2 and self.pass_size < self.max_batch:
+            self.pass_size += 1
@@ -0,0 +1,154 @@
+"""
+Score parity check for the optimized inference paths.
+
+parity_corpus.json stores a fixed set of model inputs (benign and attack
+requests, random strings, unicode, texts longer than max_len) together with
+their ae_score from the reference path: compute_ae_score(), one text padded
+to max_len. This script rescores the corpus through each optimized path and
+fails if any score drifts by more than --tolerance. Exported backends
+(export_model.py) are checked too when their files exist; an export built
+for a different model fails the check.
+
+Usage (from ml_service/):
+    python verify_parity.py                 # check every path
+    python verify_parity.py --regenerate    # rebuild the corpus for the loaded model
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+
+import app
+from backends import EXPORT_FILES, load_scorer
+
+CORPUS_FILE = "parity_corpus.json"
+
+PATHS = [
+    "/",
+    "/rest/products/search?q=apple",
+    "/rest/products/search?q=apple%20juice",
+    "/api/Products/1",
+    "/api/Products/42/reviews",
+    "/rest/basket/6",
+    "/rest/user/login",
+    "/assets/public/images/products/apple_juice.jpg",
+    "/socket.io/?EIO=4&transport=polling&t=P0aB1cD",
+    "/api/Feedbacks/?comment=Great%20product&rating=5",
+    "/rest/products/search?q=1' or '1'='1",
+    "/rest/products/search?q=1 union select id,email,password from users--",
+    "/api/Users/1;DROP TABLE users",
+    "/search?q=<script>alert(document.cookie)</script>",
+    "/api/Feedbacks/?comment=<img src=x onerror=alert(1)>",
+    "/ftp/../../etc/passwd",
+    "/ftp/..%2f..%2f..%2fwindows/win.ini",
+    "/page?file=php://filter/convert.base64-encode/resource=index.php",
+    "/cgi-bin/test.cgi?cmd=;cat /etc/shadow",
+    "/redirect?to=http://169.254.169.254/latest/meta-data/",
+    "/api/Products?name=%E2%9C%93%20caf%C3%A9",
+    "/profile?name=café ✓ 日本語",
+]
+
+METHODS = ["GET", "POST", "PUT", "DELETE"]
+
+
+def corpus_texts(seed: int = 1234) -> list:
+    """Deterministic model inputs covering every length bucket and the truncation path."""
+    rng = random.Random(seed)
+    texts = [app.build_text(p, m) for p in PATHS for m in METHODS[:2]]
+    alphabet = [chr(c) for c in range(32, 127)] + list("éü✓日本")
+    for n in [0, 1, 2, 5, 8, 16, 24, 25, 26, 31, 32, 40, 41, 42, 57, 58, 89, 121, 185, 240, 248, 249, 250, 255, 256, 300, 600]:
+        texts.append("".join(rng.choice(alphabet) for _ in range(n)))
+    for _ in range(120):
+        path = rng.choice(PATHS) + "&x=" + "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 260)))
+        texts.append(app.build_text(path, rng.choice(METHODS)))
+    return texts
+
+
+def reference_scores(texts: list) -> list:
+    return [app.compute_ae_score(t) for t in texts]
+
+
+def batched(score_fn, texts: list, batch_size: int = 32) -> list:
+    """Score in mixed-length batches, the way the scheduler feeds the model."""
+    order = list(range(len(texts)))
+    random.Random(0).shuffle(order)
+    scores = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        for i, s in zip(idx, score_fn([texts[i] for i in idx])):
+            scores[i] = s
+    return scores
+
+
+# Optimized scoring paths checked against the stored reference scores
+SCORERS = {
+    "bucketed": lambda texts: batched(lambda b: app.compute_ae_scores(b, collapsed=False), texts),
+    "collapsed": lambda texts: batched(lambda b: app.compute_ae_scores(b, collapsed=True), texts),
+}
+
+
+def backend_scorers() -> dict:
+    """SCORERS entries for the exported backends available for the loaded model."""
+    scorers = {}
+    for backend in EXPORT_FILES:
+        try:
+            scorer = load_scorer(backend, app.active.directory, app.model_digest, app.DEVICE, app.TORCH_THREADS)
+        except (FileNotFoundError, ImportError) as e:
+            print(f"{backend:>12}: skipped ({e})")
+            continue
+        scorers[backend] = lambda texts, scorer=scorer: batched(lambda b: app.compute_ae_scores(b, scorer=scorer), texts)
+    return scorers
+
+
+def regenerate():
+    texts = corpus_texts()
+    corpus = {
+        "model_digest": app.model_digest,
+        "max_len": app.max_len,
+        "items": [{"text": t, "ae_score": s} for t, s in zip(texts, reference_scores(texts))],
+    }
+    with open(CORPUS_FILE, "w", encoding="utf-8") as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=0)
+    print(f"wrote {len(texts)} reference scores to {CORPUS_FILE}")
+
+
+def verify(tolerance: float) -> bool:
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    if corpus["model_digest"] != app.model_digest:
+        print(f"corpus was built for model {corpus['model_digest']}, loaded {app.model_digest}; run with --regenerate")
+        return False
+    texts = [item["text"] for item in corpus["items"]]
+    expected = [item["ae_score"] for item in corpus["items"]]
+
+    padded = sum(app.pad_length(len(t)) for t in texts) / len(texts)
+    print(f"{len(texts)} texts, mean padded length {padded:.1f} vs max_len {app.max_len}")
+
+    ok = True
+    for name, score_fn in {**SCORERS, **backend_scorers()}.items():
+        got = score_fn(texts)
+        worst = max(abs(a - b) for a, b in zip(got, expected))
+        passed = worst <= tolerance
+        ok &= passed
+        print(f"{name:>12}: max |diff| {worst:.2e}  {'ok' if passed else 'FAIL'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--regenerate", action="store_true", help="rebuild the corpus with the reference path")
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    app.load_model()
+    if args.regenerate:
+        regenerate()
+        return
+    sys.exit(0 if verify(args.tolerance) else 1)
+
+
+if __name__ == "__main__":
+    main()
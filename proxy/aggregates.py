@@ -0,0 +1,111 @@
+"""
+Incremental counters behind the proxy dashboard endpoints.
+
+Every verdict is folded into the counters as it is produced (add()), so the
+dashboard endpoints read a bounded number of buckets instead of re-parsing
+the traffic log. The proxy resets and refills them from the log segments
+once at startup.
+
+    totals       - entries per verdict, since the start of the log
+    attack_types - blocked entries per attack type
+    by_minute    - per-verdict counts per UTC minute, for the last minute_days
+    minute_total - entries per UTC minute, for the last day_days
+
+Minute buckets give the rolling last-hour and heatmap windows minute
+resolution. The plain per-minute totals back the 30-day traffic chart, whose
+points are rolling windows of the last N x 86400 seconds (not calendar
+days), also at minute resolution.
+"""
+
+import time
+from collections import Counter
+
+from env import env_int
+
+AGGREGATE_SETTINGS = {
+    "minute_days": env_int("AGG_MINUTE_DAYS", 8),
+    "day_days": env_int("AGG_DAY_DAYS", 31),
+}
+
+ANOMALY_VERDICTS = ("blocked", "alert")
+
+
+class TrafficAggregates:
+    """Per-verdict, per-attack-type, per-minute and per-day counters."""
+
+    def __init__(self, classify, settings: dict = None):
+        """classify(reason) -> attack type, applied to blocked entries."""
+        self.settings = dict(AGGREGATE_SETTINGS, **(settings or {}))
+        self.classify = classify
+        self.reset()
+
+    def reset(self):
+        self.total = 0
+        self.totals = Counter()
+        self.attack_types = Counter()
+        self.by_minute = {}
+        self.minute_total = {}
+        self._pruned_at = 0
+
+    def add(self, entry: dict):
+        ts = entry.get("ts", 0)
+        verdict = entry.get("verdict", "unknown")
+        self.total += 1
+        self.totals[verdict] += 1
+        if verdict == "blocked":
+            self.attack_types[self.classify(entry.get("reason", ""))] += 1
+
+        now = time.time()
+        minute = int(ts // 60)
+        if minute >= (now - self.settings["minute_days"] * 86400) // 60:
+            self.by_minute.setdefault(minute, Counter())[verdict] += 1
+        if minute >= (now - self.settings["day_days"] * 86400) // 60:
+            self.minute_total[minute] = self.minute_total.get(minute, 0) + 1
+        if now - self._pruned_at >= 60:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        oldest_minute = (now - self.settings["minute_days"] * 86400) // 60
+        for minute in [m for m in self.by_minute if m < oldest_minute]:
+            del self.by_minute[minute]
+        oldest_total = (now - self.settings["day_days"] * 86400) // 60
+        for minute in [m for m in self.minute_total if m < oldest_total]:
+            del self.minute_total[minute]
+        self._pruned_at = now
+
+    # ------------------------------------------------------------- queries
+
+    def window(self, start: float, end: float) -> Counter:
+        """
+        Per-verdict counts for start < ts <= end, at minute resolution: from
+        the minute after start's up to and including end's (current, partial)
+        minute, so adjacent windows never count an entry twice.
+        """
+        counts = Counter()
+        for minute in range(int(start // 60) + 1, int(end // 60) + 1):
+            bucket = self.by_minute.get(minute)
+            if bucket:
+                counts.update(bucket)
+        return counts
+
+    def anomalies(self, start: float, end: float) -> int:
+        counts = self.window(start, end)
+        return sum(counts[v] for v in ANOMALY_VERDICTS)
+
+    def since_days(self, days: int, now: float = None) -> int:
+        """Entries in the last days x 86400 seconds, at minute resolution."""
+        return self.rolling_days(days, now)[-1] if days > 0 else 0
+
+    def rolling_days(self, days: int, now: float = None) -> list:
+        """[since_days(1), ..., since_days(days)] in one pass over the minute totals."""
+        now_minute = int((now or time.time()) // 60)
+        per_age = [0] * days  # entries whose age falls in day 0, 1, ...
+        for minute, count in self.minute_total.items():
+            age = (now_minute - minute) // 1440
+            if 0 <= age < days:
+                per_age[age] += count
+        out, running = [], 0
+        for count in per_age:
+            running += count
+            out.append(running)
+        return out
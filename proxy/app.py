@@ -1,20 +1,26 @@
 import uvicorn
+import asyncio
 import secrets
 from fastapi import FastAPI, Request, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
 import hashlib
-import json
 import os
-import re
 import time
 import yaml
 from math import log2
 from urllib.parse import unquote
-from datetime import datetime, timedelta
-from collections import defaultdict
+from itertools import islice
+from http_pool import HttpClientPool, strip_hop_by_hop
+from sig_engine import SignatureEngine
+from log_shipper import LogShipper
+from traffic_log import TrafficLogWriter
+from log_segments import iter_entries, iter_entries_reverse
+from aggregates import ANOMALY_VERDICTS, TrafficAggregates
+from recent_events import RECENT_SETTINGS, RecentEvents
+from ml_client import MLClient
 
 # Security Scheme
 security = HTTPBearer()
@@ -23,9 +29,6 @@ security = HTTPBearer()
 # In production, use a database or Redis
 VALID_TOKENS = set()
 
-# ML Result Cache (LRU-ish via size limit)
-ML_CACHE = {}
-
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify that the Bearer token is valid"""
     token = credentials.credentials
@@ -52,8 +55,8 @@ app.add_middleware(
 with open("signatures.yml", "r") as f:
     RAW_SIGS = yaml.safe_load(f)
 
-# Build SIGS list (compiled regexes)
-SIGS = [(s["id"], re.compile(s["regex"], re.IGNORECASE)) for s in RAW_SIGS]
+# Compile all signatures into one ruleset (scanned once per input)
+SIG_ENGINE = SignatureEngine(RAW_SIGS, backend=os.getenv("SIG_ENGINE_BACKEND", "auto"))
 
 # Rules state management (for frontend control)
 RULES_STATE = {
@@ -94,14 +97,27 @@ LOW_RISK = 0.3         # Silent log (forward quietly)
 # ML service URL
 ML_SERVICE = "http://127.0.0.1:9000/predict"
 
+# ML scoring client with an LRU+TTL score cache keyed on the model's input
+ML_CLIENT = MLClient({"url": ML_SERVICE})
+
 # Upstream app URL
 UPSTREAM = "http://127.0.0.1:3001" # Default to Juice Shop, prefer WAF_SETTINGS
 
-# Dataset log location
+# Dataset log location: segmented directory, plus the pre-segmentation single file
 os.makedirs("dataset", exist_ok=True)
 LOG_PATH = "dataset/traffic.jsonl"
 REQUEST_COUNTER = 0  # Simple counter for total requests
 
+# Shared keep-alive client for upstream forwarding (opened on startup)
+UPSTREAM_POOL = HttpClientPool()
+
+# Batched, non-blocking shipping of log entries to the dashboard backend
+LOG_SHIPPER = LogShipper()
+
+# Group-commit writer thread that owns the traffic log segments
+TRAFFIC_LOG = TrafficLogWriter()
+LOG_DIR = TRAFFIC_LOG.segments.directory
+
 
 
 def entropy(s):
@@ -129,27 +145,73 @@ def extract_features(body: str, url: str = "") -> dict:
     }
 
 
-async def forward_upstream(req: Request):
-    async with httpx.AsyncClient() as client:
-        body = await req.body()
-        headers = dict(req.headers)
-        headers.pop("host", None)
+class UpstreamResponse(StreamingResponse):
+    """
+    Streams a pooled upstream response. The stream is closed and its pool slot
+    released however the response ends, including when the client disconnects
+    before the body is iterated.
+    """
+
+    def __init__(self, upstream: httpx.Response, slot):
+        super().__init__(UPSTREAM_POOL.iter_raw(upstream, slot), status_code=upstream.status_code)
+        self.upstream = upstream
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
         try:
-            # Use configured upstream URL
-            upstream_url = WAF_SETTINGS.get("upstream_url", UPSTREAM)
-            target_url = f"{upstream_url}{req.url.path}"
-            if req.url.query:
-                target_url += f"?{req.url.query}"
-
-            resp = await client.request(
-                req.method,
-                target_url,
-                content=body,
-                headers=headers
-            )
-            return JSONResponse(content=resp.text, status_code=resp.status_code)
-        except httpx.RequestError as e:
-            return JSONResponse(status_code=502, content={"detail": "Upstream unavailable", "error": str(e)})
+            await super().__call__(scope, receive, send)
+        finally:
+            await UPSTREAM_POOL.close_stream(self.upstream, self.slot)
+
+
+async def forward_upstream(req: Request):
+    """Relay the request upstream and stream the response back byte-for-byte."""
+    body = await req.body()
+    headers = [(k, v) for k, v in strip_hop_by_hop(req.headers.items()) if k.lower() != "host"]
+    try:
+        # Use configured upstream URL
+        upstream_url = WAF_SETTINGS.get("upstream_url", UPSTREAM)
+        target_url = f"{upstream_url}{req.url.path}"
+        if req.url.query:
+            target_url += f"?{req.url.query}"
+
+        resp, slot = await UPSTREAM_POOL.open_stream(
+            req.method,
+            target_url,
+            content=body,
+            headers=headers
+        )
+    except httpx.RequestError as e:
+        return JSONResponse(status_code=502, content={"detail": "Upstream unavailable", "error": str(e)})
+
+    # Raw (still content-encoded) bytes are relayed, so upstream headers such as
+    # Content-Encoding and Content-Length stay valid. Repeated headers like
+    # Set-Cookie are appended one by one to keep every value. Date and Server
+    # are emitted by our own HTTP server, so the upstream copies are dropped.
+    response = UpstreamResponse(resp, slot)
+    for name, value in strip_hop_by_hop(resp.headers.multi_items()):
+        if name.lower() not in ("date", "server"):
+            response.headers.append(name, value)
+    return response
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Rebuild dashboard views, open the upstream pool and start the log writers."""
+    await asyncio.to_thread(rebuild_views)
+    await UPSTREAM_POOL.start()
+    await ML_CLIENT.start()
+    await LOG_SHIPPER.start()
+    TRAFFIC_LOG.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued log entries and close pooled upstream connections."""
+    await LOG_SHIPPER.stop()
+    await asyncio.to_thread(TRAFFIC_LOG.stop)
+    await ML_CLIENT.stop()
+    await UPSTREAM_POOL.close()
 
 
 @app.get("/health")
@@ -157,24 +219,6 @@ async def health():
     return {"status": "ok"}
 
 
-def load_logs():
-    """Load all log entries from the traffic.jsonl file"""
-    logs = []
-    if os.path.exists(LOG_PATH):
-        try:
-            with open(LOG_PATH, "r") as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        try:
-                            logs.append(json.loads(line))
-                        except json.JSONDecodeError:
-                            continue
-        except Exception:
-            pass
-    return logs
-
-
 def get_attack_type_from_reason(reason: str) -> str:
     """Extract attack type from reason string"""
     if not reason:
@@ -201,12 +245,49 @@ def get_attack_type_from_reason(reason: str) -> str:
     return "Unknown"
 
 
+# Dashboard views, updated per verdict and rebuilt from the log at startup
+AGGREGATES = TrafficAggregates(get_attack_type_from_reason)
+RECENT_EVENTS = RecentEvents(RECENT_SETTINGS["events"])
+RECENT_ALERTS = RecentEvents(RECENT_SETTINGS["alerts"])
+
+
+def index_verdict(log_entry: dict):
+    """Fold a verdict into the dashboard counters and recent-event buffers"""
+    AGGREGATES.add(log_entry)
+    RECENT_EVENTS.add(log_entry)
+    if log_entry.get("verdict") in ANOMALY_VERDICTS:
+        RECENT_ALERTS.add(log_entry)
+
+
+def record_verdict(log_entry: dict):
+    """Persist a verdict to the traffic log and update the dashboard views"""
+    TRAFFIC_LOG.write(log_entry)
+    index_verdict(log_entry)
+
+
+def rebuild_views():
+    """Recount the dashboard views from the traffic log (runs once at startup)"""
+    AGGREGATES.reset()
+    RECENT_EVENTS.clear()
+    RECENT_ALERTS.clear()
+    for entry in iter_entries(LOG_DIR, legacy_path=LOG_PATH):
+        index_verdict(entry)
+
+
+def read_history(limit: int, offset: int = 0, verdicts=None) -> list:
+    """Newest-first page of log entries read backwards from the segments, for pages past the buffers"""
+    limit, offset = max(0, limit), max(0, offset)
+    entries = iter_entries_reverse(LOG_DIR, legacy_path=LOG_PATH)
+    if verdicts:
+        entries = (e for e in entries if e.get("verdict") in verdicts)
+    return list(islice(entries, offset, offset + limit))
+
+
 @app.get("/api/kpis")
 async def get_kpis():
     """Get KPI metrics"""
-    logs = load_logs()
-    blocked = sum(1 for log in logs if log.get("verdict") == "blocked")
-    total_requests = REQUEST_COUNTER if REQUEST_COUNTER > 0 else len(logs) * 10  # Estimate if counter not available
+    blocked = AGGREGATES.totals["blocked"]
+    total_requests = REQUEST_COUNTER if REQUEST_COUNTER > 0 else AGGREGATES.total * 10  # Estimate if counter not available
     false_positives = 0  # Would need manual marking
     model_confidence = 0.87  # Could be calculated from ML scores
     
@@ -221,13 +302,14 @@ async def get_kpis():
 @app.get("/api/logs")
 async def get_logs(limit: int = 100, offset: int = 0):
     """Get logs with pagination"""
-    logs = load_logs()
-    # Sort by timestamp descending (most recent first)
-    logs.sort(key=lambda x: x.get("ts", 0), reverse=True)
+    # Most recent first: served from the ring buffer, or read back from disk past it
+    logs = RECENT_EVENTS.latest(limit, offset)
+    if logs is None:
+        logs = await asyncio.to_thread(read_history, limit, offset)
     
     # Convert to frontend format
     result = []
-    for i, log in enumerate(logs[offset:offset+limit]):
+    for i, log in enumerate(logs):
         reason = log.get("reason", "Unknown")
         attack_type = get_attack_type_from_reason(reason)
         
@@ -259,19 +341,19 @@ async def get_logs(limit: int = 100, offset: int = 0):
             "timestamp": int(log.get("ts", time.time()) * 1000)  # Convert to milliseconds
         })
     
-    return {"logs": result, "total": len(logs)}
+    return {"logs": result, "total": AGGREGATES.total}
 
 
 @app.get("/api/alerts")
 async def get_alerts(limit: int = 10):
     """Get recent alerts"""
-    logs = load_logs()
-    # Filter for blocked or alerted requests
-    alerts = [log for log in logs if log.get("verdict") in ["blocked", "alert"]]
-    alerts.sort(key=lambda x: x.get("ts", 0), reverse=True)
+    # Blocked or alerted requests, most recent first
+    alerts = RECENT_ALERTS.latest(limit)
+    if alerts is None:
+        alerts = await asyncio.to_thread(read_history, limit, 0, ANOMALY_VERDICTS)
     
     result = []
-    for i, log in enumerate(alerts[:limit]):
+    for i, log in enumerate(alerts):
         reason = log.get("reason", "Unknown")
         attack_type = get_attack_type_from_reason(reason)
         
@@ -299,14 +381,12 @@ async def get_alerts(limit: int = 10):
 @app.get("/api/traffic")
 async def get_traffic():
     """Get traffic data for last 30 days"""
-    logs = load_logs()
-    # Group by day (simplified - would need proper date parsing)
+    # Point i counts traffic in the trailing (30-i) x 86400 seconds
     # For now, return estimated data
+    rolling = AGGREGATES.rolling_days(30)
     traffic_data = []
     for i in range(30):
-        # Count logs from roughly that day (simplified)
-        day_logs = [log for log in logs if log.get("ts", 0) > time.time() - (30-i)*86400]
-        count = len([l for l in day_logs if l.get("ts", 0) > time.time() - (30-i+1)*86400])
+        count = rolling[30 - i - 1]
         traffic_data.append(max(500, count * 10))  # Estimate with minimum
     
     return {"trafficData": traffic_data}
@@ -315,24 +395,8 @@ async def get_traffic():
 @app.get("/api/owasp")
 async def get_owasp():
     """Get OWASP threat distribution"""
-    logs = load_logs()
-    counts = defaultdict(int)
-    
-    for log in logs:
-        if log.get("verdict") == "blocked":
-            reason = log.get("reason", "")
-            attack_type = get_attack_type_from_reason(reason)
-            if attack_type == "SQLi":
-                counts["SQLi"] += 1
-            elif attack_type == "XSS":
-                counts["XSS"] += 1
-            elif attack_type == "Command Injection":
-                counts["Command Injection"] += 1
-            elif attack_type == "Path Traversal":
-                counts["Path Traversal"] += 1
-            elif attack_type == "CSRF":
-                counts["CSRF"] += 1
-    
+    counts = AGGREGATES.attack_types
+
     # Ensure all categories exist with at least 0
     result = {
         "SQLi": counts.get("SQLi", 0),
@@ -348,13 +412,10 @@ async def get_owasp():
 @app.get("/api/heatmap")
 async def get_heatmap():
     """Get heatmap data for last 7 days (7 days x 24 hours = 168 cells)"""
-    logs = load_logs()
     heatmap = []
     current_time = time.time()
     
     # Only count blocked/alerted requests for anomaly heatmap
-    anomaly_logs = [log for log in logs if log.get("verdict") in ["blocked", "alert"]]
-    
     for day in range(7):
         day_data = []
         day_start = current_time - (7 - day) * 86400
@@ -364,8 +425,7 @@ async def get_heatmap():
             hour_end = day_start - (23 - hour) * 3600
             
             # Count anomalies in this hour
-            count = len([log for log in anomaly_logs 
-                        if hour_start <= log.get("ts", 0) < hour_end])
+            count = AGGREGATES.anomalies(hour_start, hour_end)
             
             # Normalize: 0-1 scale, where 1 = 10+ anomalies in that hour
             normalized = min(1.0, count / 10.0) if count > 0 else 0.0
@@ -379,16 +439,16 @@ async def get_heatmap():
 @app.get("/api/stats")
 async def get_stats():
     """Get real-time WAF statistics"""
-    logs = load_logs()
-    recent_logs = [log for log in logs if log.get("ts", 0) > time.time() - 3600]  # Last hour
+    now = time.time()
+    recent = AGGREGATES.window(now - 3600, now)  # Last hour
     
     return {
         "totalRequests": REQUEST_COUNTER,
-        "blockedLastHour": sum(1 for log in recent_logs if log.get("verdict") == "blocked"),
-        "allowedLastHour": sum(1 for log in recent_logs if log.get("verdict") not in ["blocked", "alert"]),
-        "alertsLastHour": sum(1 for log in recent_logs if log.get("verdict") == "alert"),
-        "totalBlocked": sum(1 for log in logs if log.get("verdict") == "blocked"),
-        "totalAlerts": sum(1 for log in logs if log.get("verdict") == "alert")
+        "blockedLastHour": recent["blocked"],
+        "allowedLastHour": sum(recent.values()) - recent["blocked"] - recent["alert"],
+        "alertsLastHour": recent["alert"],
+        "totalBlocked": AGGREGATES.totals["blocked"],
+        "totalAlerts": AGGREGATES.totals["alert"]
     }
 
 
@@ -419,6 +479,19 @@ async def api_health():
     return {"status": "ok", "service": "waf-proxy"}
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Internal proxy metrics (connection pool utilization, etc.)"""
+    return {
+        "requests": REQUEST_COUNTER,
+        "upstream_pool": UPSTREAM_POOL.stats(),
+        "log_shipper": LOG_SHIPPER.stats(),
+        "traffic_log": TRAFFIC_LOG.stats(),
+        "ml_client": ML_CLIENT.stats(),
+        "signature_engine": SIG_ENGINE.stats()
+    }
+
+
 @app.get("/api/rules")
 async def list_rules():
     """List all signature rules with enabled status"""
@@ -512,119 +585,70 @@ async def waf_entry(req: Request, path: str):
     if req.url.query:
         full_url += "?" + req.url.query
     url_decoded = unquote(full_url)
-    url_and_body = body_text + " " + url_decoded
-
-    for sig_id, regex in SIGS:
-        if regex.search(body_text) or regex.search(url_decoded):
-            log_entry["verdict"] = "blocked"
-            log_entry["reason"] = f"SIG:{sig_id}"
-            with open(LOG_PATH, "a") as f:
-                f.write(json.dumps(log_entry) + "\n")
-            try:
-                print(f"Attempting ingestion for SIG:{sig_id}")
-                resp = httpx.post("http://127.0.0.1:5000/api/ingest_log", json={**log_entry, "severity": "High", "detection_source": "Signature"}, timeout=2)
-                print(f"Ingestion result: {resp.status_code}")
-            except Exception as e:
-                print(f"Ingestion failed: {e}")
-                import traceback
-                traceback.print_exc()
-            return JSONResponse(status_code=403, content={"detail": "Blocked by signature", "id": sig_id})
+
+    matched = SIG_ENGINE.scan(body_text, url_decoded)
+    if matched:
+        sig_id = matched[0]
+        log_entry["verdict"] = "blocked"
+        log_entry["reason"] = f"SIG:{sig_id}"
+        log_entry["signatures"] = matched
+        record_verdict(log_entry)
+        LOG_SHIPPER.ship({**log_entry, "severity": "High", "detection_source": "Signature"})
+        return JSONResponse(status_code=403, content={"detail": "Blocked by signature", "id": sig_id, "matches": matched})
 
     # Updated to support new ML Service schema (Notebook replication)
     # We send raw attributes so ML service can encode them
-    # Check Cache for ML Score
-    if url_and_body in ML_CACHE:
-        score = ML_CACHE[url_and_body]
-    else:
-        # Updated to support new ML Service schema (Notebook replication)
-        # We send raw attributes so ML service can encode them
-        raw_payload = {
-            "raw_request": {
-                "method": req.method,
-                "url": str(req.url),   # Or url_decoded if trained on that
-                "headers": dict(req.headers), # Headers dict
-                "user_agent": req.headers.get("user-agent", ""),
-                "accept": req.headers.get("accept", ""),
-                "host": req.headers.get("host", ""),
-                "cookie": req.headers.get("cookie", ""),
-                "content_type": req.headers.get("content-type", ""),
-                "content_length": len(body),
-                "body": body_text # Truncate if necessary, but notebook used full
-            }
-        }
-
-        try:
-            async with httpx.AsyncClient() as client:
-                r = await client.post(ML_SERVICE, json=raw_payload, timeout=2)
-                if r.status_code == 200:
-                    score = r.json().get("score", 0.0)
-                else:
-                    score = 0.0
-        except Exception as e:
-            # Fallback if ML service is down
-            score = 0.0
-        
-        # Update Cache (manage size)
-        if len(ML_CACHE) > 1000:
-            ML_CACHE.clear()
-        ML_CACHE[url_and_body] = score
+    raw_request = {
+        "method": req.method,
+        "url": str(req.url),   # Or url_decoded if trained on that
+        "headers": dict(req.headers), # Headers dict
+        "user_agent": req.headers.get("user-agent", ""),
+        "accept": req.headers.get("accept", ""),
+        "host": req.headers.get("host", ""),
+        "cookie": req.headers.get("cookie", ""),
+        "content_type": req.headers.get("content-type", ""),
+        "content_length": len(body),
+        "body": body_text # Truncate if necessary, but notebook used full
+    }
+    # Cached by the model's own input (method + path); falls back to 0.0 if the service is down
+    score = await ML_CLIENT.score(raw_request, WAF_SETTINGS.get("ml_service_url", ML_SERVICE))
 
     log_entry["score"] = round(score, 2)
 
     if score >= VERY_HIGH_RISK:
         log_entry["verdict"] = "blocked"
         log_entry["reason"] = f"ML:{score:.2f} (very high)"
-        with open(LOG_PATH, "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
-        try:
-            httpx.post("http://127.0.0.1:5000/api/ingest_log", json={**log_entry, "severity": "Critical" if score >= 0.85 else "High" if score >= 0.7 else "Medium", "detection_source": "ML"}, timeout=2)
-        except:
-            pass
+        record_verdict(log_entry)
+        LOG_SHIPPER.ship({**log_entry, "severity": "Critical" if score >= 0.85 else "High" if score >= 0.7 else "Medium", "detection_source": "ML"})
         return JSONResponse(status_code=403, content={"detail": "Blocked and reported", "score": score})
 
     elif score >= HIGH_RISK:
         log_entry["verdict"] = "blocked"
         log_entry["reason"] = f"ML:{score:.2f} (high)"
-        with open(LOG_PATH, "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
-        try:
-            httpx.post("http://127.0.0.1:5000/api/ingest_log", json={**log_entry, "severity": "Critical" if score >= 0.85 else "High" if score >= 0.7 else "Medium", "detection_source": "ML"}, timeout=2)
-        except:
-            pass
+        record_verdict(log_entry)
+        LOG_SHIPPER.ship({**log_entry, "severity": "Critical" if score >= 0.85 else "High" if score >= 0.7 else "Medium", "detection_source": "ML"})
         return JSONResponse(status_code=403, content={"detail": "Blocked by ML", "score": score})
 
     elif score >= MEDIUM_RISK:
         log_entry["verdict"] = "alert"
         log_entry["reason"] = f"ML:{score:.2f} (medium)"
-        with open(LOG_PATH, "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
-        try:
-            httpx.post("http://127.0.0.1:5000/api/ingest_log", json={**log_entry, "severity": "Critical" if score >= 0.85 else "High" if score >= 0.7 else "Medium", "detection_source": "ML"}, timeout=2)
-        except:
-            pass
+        record_verdict(log_entry)
+        LOG_SHIPPER.ship({**log_entry, "severity": "Critical" if score >= 0.85 else "High" if score >= 0.7 else "Medium", "detection_source": "ML"})
         return await forward_upstream(req)
 
     elif score >= LOW_RISK:
         log_entry["verdict"] = "logged"
         log_entry["reason"] = f"ML:{score:.2f} (low)"
-        with open(LOG_PATH, "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
-        try:
-            httpx.post("http://127.0.0.1:5000/api/ingest_log", json={**log_entry, "severity": "Low", "detection_source": "ML"}, timeout=2)
-        except:
-            pass
+        record_verdict(log_entry)
+        LOG_SHIPPER.ship({**log_entry, "severity": "Low", "detection_source": "ML"})
         return await forward_upstream(req)
 
     else:
         # Log SAFE traffic for dataset generation
         log_entry["verdict"] = "safe"
         log_entry["reason"] = f"ML:{score:.2f} (safe)"
-        with open(LOG_PATH, "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
-        try:
-            httpx.post("http://127.0.0.1:5000/api/ingest_log", json={**log_entry, "severity": "Low", "detection_source": "Safe"}, timeout=2)
-        except:
-            pass
+        record_verdict(log_entry)
+        LOG_SHIPPER.ship({**log_entry, "severity": "Low", "detection_source": "Safe"})
         return await forward_upstream(req)
 
 
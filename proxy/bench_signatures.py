@@ -0,0 +1,104 @@
+"""
+Signature engine throughput benchmark.
+
+Compares the old per-rule loop (two regex.search calls per signature) with
+every available SignatureEngine backend while the ruleset grows, plus the
+python backend with its literal prefilter disabled. Larger rulesets are built
+by repeating signatures.yml under new IDs.
+
+Usage:
+    python bench_signatures.py [--sizes 37,148,592] [--seconds 1.0]
+"""
+
+import argparse
+import re
+import time
+
+import yaml
+
+from sig_engine import BACKENDS, SignatureEngine
+
+BENIGN = [
+    ("", "/rest/products/search?q=apple juice"),
+    ("", "/api/Products/1"),
+    ('{"email":"user@example.com","password":"hunter22"}', "/rest/user/login"),
+    ("", "/assets/public/images/products/apple_juice.jpg"),
+    ("comment=Great product, would buy again&rating=5", "/api/Feedbacks/"),
+]
+
+ATTACKS = [
+    ("", "/rest/products/search?q=1 union select id,email from users--"),
+    ("<img src=x onerror=alert(1)>", "/api/Feedbacks/"),
+    ("", "/ftp/../../etc/passwd"),
+]
+
+
+def load_rules(path: str = "signatures.yml") -> list:
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def scale_rules(rules: list, size: int) -> list:
+    out = []
+    copy = 0
+    while len(out) < size:
+        for r in rules:
+            if len(out) == size:
+                break
+            out.append({"id": f"{r['id']}_{copy}", "regex": r["regex"]})
+        copy += 1
+    return out
+
+
+def naive_scan(compiled, body: str, url: str) -> list:
+    return [sig_id for sig_id, regex in compiled if regex.search(body) or regex.search(url)]
+
+
+def throughput(fn, inputs, seconds: float) -> float:
+    """Requests scanned per second."""
+    n = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for body, url in inputs:
+            fn(body, url)
+        n += len(inputs)
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=None, help="comma-separated ruleset sizes")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per measurement")
+    args = parser.parse_args()
+
+    base = load_rules()
+    sizes = [int(x) for x in args.sizes.split(",")] if args.sizes else [len(base), len(base) * 4, len(base) * 16]
+
+    backends = []
+    for name in BACKENDS:
+        try:
+            SignatureEngine(base, backend=name)
+            backends.append(name)
+        except Exception as e:
+            print(f"[skip] {name}: {e}")
+    variants = [(b, b, True) for b in backends] + [("no-prefilter", "python", False)]
+
+    header = f"{'rules':>6} {'traffic':>8} {'naive':>10}" + "".join(f" {label:>12}" for label, _, _ in variants)
+    print("requests/second (higher is better)")
+    print(header)
+    print("-" * len(header))
+    for size in sizes:
+        rules = scale_rules(base, size)
+        compiled = [(r["id"], re.compile(r["regex"], re.IGNORECASE)) for r in rules]
+        engines = {label: SignatureEngine(rules, backend=b, prefilter=pf) for label, b, pf in variants}
+        for label, inputs in (("benign", BENIGN), ("attack", ATTACKS)):
+            row = f"{size:>6} {label:>8}"
+            row += f" {throughput(lambda b, u: naive_scan(compiled, b, u), inputs, args.seconds):>10.0f}"
+            for name, _, _ in variants:
+                row += f" {throughput(engines[name].scan, inputs, args.seconds):>12.0f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
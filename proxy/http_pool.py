@@ -0,0 +1,204 @@
+"""
+Shared, long-lived HTTP client pool for the WAF proxy.
+
+A single httpx.AsyncClient is created when the app starts and closed when it
+shuts down, so forwarded requests reuse keep-alive connections instead of
+paying a TCP/TLS handshake each time. httpx only limits connections globally,
+so per-host limits are enforced here with one semaphore per upstream host.
+
+Utilization is counted here (requests, open streams, per-host slots, HTTP
+versions of the responses) rather than read from httpx's internal pool.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import httpx
+
+from env import env_bool, env_float, env_int
+
+try:
+    import h2  # noqa: F401  (only needed to enable HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# Pool configuration (overridable via environment)
+POOL_SETTINGS = {
+    "max_connections": env_int("UPSTREAM_MAX_CONNECTIONS", 200),
+    "max_keepalive_connections": env_int("UPSTREAM_MAX_KEEPALIVE", 50),
+    "keepalive_expiry": env_float("UPSTREAM_KEEPALIVE_EXPIRY", 30.0),
+    "max_per_host": env_int("UPSTREAM_MAX_PER_HOST", 100),
+    "connect_timeout": env_float("UPSTREAM_CONNECT_TIMEOUT", 5.0),
+    "read_timeout": env_float("UPSTREAM_READ_TIMEOUT", 30.0),
+    "http2": env_bool("UPSTREAM_HTTP2", True),
+    "chunk_size": env_int("UPSTREAM_CHUNK_SIZE", 64 * 1024),
+}
+
+# Connection-scoped headers that must not be relayed by a proxy (RFC 9110 7.6.1)
+HOP_BY_HOP_HEADERS = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "proxy-connection", "te", "trailer", "trailers", "transfer-encoding", "upgrade",
+})
+
+
+def strip_hop_by_hop(items):
+    """Filter (name, value) pairs, dropping hop-by-hop headers and any named in Connection."""
+    items = list(items)
+    extra = set()
+    for name, value in items:
+        if name.lower() == "connection":
+            extra.update(tok.strip().lower() for tok in value.split(","))
+    return [(k, v) for k, v in items if k.lower() not in HOP_BY_HOP_HEADERS and k.lower() not in extra]
+
+
+class HttpClientPool:
+    """Lifecycle wrapper around a shared httpx.AsyncClient with per-host limits."""
+
+    def __init__(self, settings: dict = None):
+        self.settings = dict(POOL_SETTINGS, **(settings or {}))
+        self.client = None
+        self._host_slots = {}
+        self._slots_in_use = Counter()  # semaphore -> slots held
+        self._streams = set()  # streamed responses not yet closed
+        self._http_versions = Counter()
+        self._in_flight = 0
+        self._requests_total = 0
+        self._wait_time_total = 0.0
+        self._errors_total = 0
+        self._started_at = None
+
+    @property
+    def http2_enabled(self) -> bool:
+        return self.settings["http2"] and HTTP2_AVAILABLE
+
+    async def start(self):
+        """Create the shared client. Safe to call more than once."""
+        if self.client is not None:
+            return
+        s = self.settings
+        limits = httpx.Limits(
+            max_connections=s["max_connections"],
+            max_keepalive_connections=s["max_keepalive_connections"],
+            keepalive_expiry=s["keepalive_expiry"],
+        )
+        timeout = httpx.Timeout(s["read_timeout"], connect=s["connect_timeout"])
+        self.client = httpx.AsyncClient(limits=limits, timeout=timeout, http2=self.http2_enabled)
+        self._started_at = time.time()
+
+    async def close(self):
+        """Close all pooled connections."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _slot(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = asyncio.Semaphore(self.settings["max_per_host"])
+            self._host_slots[host] = slot
+        return slot
+
+    async def acquire(self, url: str) -> asyncio.Semaphore:
+        """Wait for a per-host slot; the caller must release() it when done."""
+        if self.client is None:
+            await self.start()
+        slot = self._slot(url)
+        t0 = time.perf_counter()
+        await slot.acquire()
+        self._wait_time_total += time.perf_counter() - t0
+        self._in_flight += 1
+        self._requests_total += 1
+        self._slots_in_use[slot] += 1
+        return slot
+
+    def release(self, slot: asyncio.Semaphore, error: bool = False):
+        self._in_flight -= 1
+        self._slots_in_use[slot] -= 1
+        if error:
+            self._errors_total += 1
+        slot.release()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a fully buffered request through the pool."""
+        slot = await self.acquire(url)
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+        except BaseException:
+            # Also cancellation and bad URLs (InvalidURL is no HTTPError): never keep the slot
+            self.release(slot, error=True)
+            raise
+        self.release(slot)
+        self._http_versions[resp.http_version] += 1
+        return resp
+
+    async def open_stream(self, method: str, url: str, **kwargs):
+        """
+        Send a request and return (response, slot) without reading the body.
+
+        The body is read through iter_raw(). The caller must also make sure
+        close_stream() runs once it is done with the response, even if the
+        body is never iterated (e.g. the client went away first).
+        """
+        slot = await self.acquire(url)
+        try:
+            request = self.client.build_request(method, url, **kwargs)
+            resp = await self.client.send(request, stream=True)
+        except BaseException:
+            self.release(slot, error=True)
+            raise
+        self._streams.add(resp)
+        self._http_versions[resp.http_version] += 1
+        return resp, slot
+
+    async def close_stream(self, resp: httpx.Response, slot: asyncio.Semaphore, error: bool = False):
+        """Close a response from open_stream() and release its slot. Later calls do nothing."""
+        if resp not in self._streams:
+            return
+        self._streams.discard(resp)
+        try:
+            await resp.aclose()
+        finally:
+            self.release(slot, error=error)
+
+    async def iter_raw(self, resp: httpx.Response, slot: asyncio.Semaphore):
+        """Yield the undecoded response body chunk by chunk, closing the stream at the end."""
+        error = False
+        try:
+            async for chunk in resp.aiter_raw(self.settings["chunk_size"]):
+                yield chunk
+        except httpx.HTTPError:
+            error = True
+            raise
+        finally:
+            await self.close_stream(resp, slot, error=error)
+
+    def stats(self) -> dict:
+        """Pool utilization snapshot for the metrics endpoint."""
+        s = self.settings
+        return {
+            "started_at": self._started_at,
+            "http2_enabled": self.http2_enabled,
+            "limits": {
+                "max_connections": s["max_connections"],
+                "max_keepalive_connections": s["max_keepalive_connections"],
+                "keepalive_expiry": s["keepalive_expiry"],
+                "max_per_host": s["max_per_host"],
+            },
+            "requests": {
+                "in_flight": self._in_flight,
+                "open_streams": len(self._streams),
+                "utilization": round(self._in_flight / s["max_connections"], 4) if s["max_connections"] else 0.0,
+                "by_http_version": dict(self._http_versions),
+                "total": self._requests_total,
+                "errors": self._errors_total,
+                "avg_slot_wait_ms": round(self._wait_time_total / self._requests_total * 1000, 3) if self._requests_total else 0.0,
+            },
+            "per_host_in_use": {
+                host: self._slots_in_use[slot] for host, slot in self._host_slots.items()
+            },
+        }
@@ -0,0 +1,204 @@
+"""
+Literal-factor prefilter for signature regexes.
+
+Most signatures can only match if some fixed string appears in the input
+("union", "/etc/passwd", "169.254.169.254", ...). extract_factors() walks the
+parsed regex and returns a set of literals of which at least one must occur
+in any match. LiteralPrefilter indexes those literals for all rules in an
+Aho-Corasick automaton, so one linear scan of the case-folded input tells us
+which rules are worth running; clean traffic usually activates none.
+
+Case folding follows re.IGNORECASE rather than str.casefold(): sre compares
+characters by their simple (one-to-one) lowercase plus a few extra
+equivalences ("ſ" = "s", "ı" = "i", ...), so fold() maps every character to
+one representative of that class. str.casefold() would turn "İ" into two
+characters and "ſ" into "s" but not "ı" into "i", and the prefilter would
+then skip rules the regex matches.
+
+pyahocorasick is used when installed. Otherwise the literals are compiled
+into a single lookahead regex which reports the longest literal starting at
+each position; shorter literals sharing that start are prefixes of it and are
+added from a precomputed table, so the result is the same.
+"""
+
+import re
+
+import _sre
+
+try:
+    from re import _parser as sre_parse
+    from re._casefix import _EXTRA_CASES
+except ImportError:  # Python < 3.11
+    import sre_parse
+    from sre_compile import _ignorecase_fixes as _EXTRA_CASES
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+# Limits for the literal algebra: sets larger than this stop being expanded
+MAX_LITERAL_SET = 64
+MAX_CLASS_SIZE = 8
+# Factors shorter than this filter nothing useful and are ignored
+MIN_FACTOR_LEN = 2
+
+
+class _FoldTable(dict):
+    """str.translate() table mapping code points to their re.IGNORECASE class representative."""
+
+    def __missing__(self, cp):
+        lower = _sre.unicode_tolower(cp)
+        folded = min((lower, *_EXTRA_CASES.get(lower, ())))
+        self[cp] = folded
+        return folded
+
+
+_FOLD = _FoldTable()
+
+
+def fold(text: str) -> str:
+    """Case-fold text the way re.IGNORECASE compares characters (one char in, one char out)."""
+    if text.isascii():
+        return text.lower()
+    return text.translate(_FOLD)
+
+
+def _exact(items):
+    """Finite set of strings matched by items, or None if not small/literal."""
+    out = {""}
+    for op, av in items:
+        ex = _exact_item(op, av)
+        if ex is None or len(out) * len(ex) > MAX_LITERAL_SET:
+            return None
+        out = {a + b for a in out for b in ex}
+    return out
+
+
+def _exact_item(op, av):
+    if op is sre_parse.LITERAL:
+        return {chr(av)}
+    if op is sre_parse.AT:
+        return {""}
+    if op is sre_parse.IN:
+        if len(av) <= MAX_CLASS_SIZE and all(o is sre_parse.LITERAL for o, _ in av):
+            return {chr(c) for _, c in av}
+        return None
+    if op is sre_parse.SUBPATTERN:
+        return _exact(av[-1])
+    if op is sre_parse.BRANCH:
+        out = set()
+        for alt in av[1]:
+            ex = _exact(alt)
+            if ex is None:
+                return None
+            out |= ex
+            if len(out) > MAX_LITERAL_SET:
+                return None
+        return out
+    return None
+
+
+def _required_item(op, av):
+    """Any-of literal set required by a single non-literal item, or None."""
+    if op is sre_parse.SUBPATTERN:
+        return _required(av[-1])
+    if op is sre_parse.BRANCH:
+        out = set()
+        for alt in av[1]:
+            req = _required(alt)
+            if req is None:
+                return None
+            out |= req
+        return out
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+        lo, _, body = av
+        return _required(body) if lo >= 1 else None
+    return None
+
+
+def _score(literals):
+    return (min(len(s) for s in literals), -len(literals))
+
+
+def _required(items):
+    """Best any-of literal set that every match of items must contain."""
+    candidates = []
+    run = {""}
+    for op, av in items:
+        ex = _exact_item(op, av)
+        if ex is not None and len(run) * len(ex) <= MAX_LITERAL_SET:
+            run = {a + b for a in run for b in ex}
+            continue
+        if "" not in run:
+            candidates.append(run)
+        run = {""}
+        req = _required_item(op, av)
+        if req is not None:
+            candidates.append(req)
+    if "" not in run:
+        candidates.append(run)
+    candidates = [c for c in candidates if min(len(s) for s in c) >= MIN_FACTOR_LEN]
+    return max(candidates, key=_score) if candidates else None
+
+
+def extract_factors(pattern: str, flags: int = re.IGNORECASE):
+    """
+    Return a frozenset of fold()ed literals, one of which occurs in every
+    match of pattern, or None if no useful literal factor exists.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return None
+    factors = _required(list(parsed))
+    if factors is None:
+        return None
+    return frozenset(fold(s) for s in factors)
+
+
+class LiteralPrefilter:
+    """Map an input to the rules whose required literals it contains."""
+
+    def __init__(self, factors: dict):
+        """factors: {rule_index: frozenset of literals} (fold()ed)."""
+        self.literal_rules = {}
+        for rule, literals in factors.items():
+            for lit in literals:
+                self.literal_rules.setdefault(lit, set()).add(rule)
+        literals = sorted(self.literal_rules, key=len, reverse=True)
+
+        if ahocorasick is not None:
+            self.backend = "ahocorasick"
+            self._automaton = ahocorasick.Automaton()
+            for lit in literals:
+                self._automaton.add_word(lit, frozenset(self.literal_rules[lit]))
+            self._automaton.make_automaton()
+        else:
+            self.backend = "regex"
+            self._scanner = re.compile(
+                "(?=(" + "|".join(re.escape(lit) for lit in literals) + "))", re.DOTALL
+            ) if literals else None
+            # Every other literal that is a prefix of a given literal
+            self._prefix_rules = {}
+            for lit in literals:
+                rules = set()
+                for i in range(1, len(lit) + 1):
+                    rules |= self.literal_rules.get(lit[:i], set())
+                self._prefix_rules[lit] = frozenset(rules)
+
+    def __len__(self):
+        return len(self.literal_rules)
+
+    def candidates(self, folded_text: str) -> set:
+        """Rules whose literal factors appear in folded_text (already fold()ed)."""
+        rules = set()
+        if self.backend == "ahocorasick":
+            if len(self._automaton):
+                for _, matched in self._automaton.iter(folded_text):
+                    rules |= matched
+        elif self._scanner is not None:
+            for m in self._scanner.finditer(folded_text):
+                rules |= self._prefix_rules[m.group(1)]
+        return rules
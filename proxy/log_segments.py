@@ -0,0 +1,365 @@
+"""
+Time-partitioned, segmented storage for the proxy traffic log.
+
+Entries are appended to JSONL segments under LOG_DIR, one partition per
+period seconds (hourly by default):
+
+    traffic-20261016-130000-001.jsonl       active / sealed segment
+    traffic-20261016-130000-001.jsonl.zst   sealed segment, zstd-compressed
+    traffic-20261016-130000-001.meta.json   sidecar
+
+A segment is sealed when its period has elapsed or when it reaches
+max_bytes; the next one gets a new partition or sequence number. Each
+sidecar records min/max timestamp, entry count and verdict counts, so
+time-range readers skip whole segments without opening them. Sealed
+segments are optionally compressed, and retention deletes the oldest ones
+past retention_hours or beyond retention_bytes in total.
+
+SegmentWriter is used only by the traffic log writer thread; the reader
+functions are safe to call from anywhere.
+"""
+
+import json
+import os
+import re
+import time
+
+from env import env_float, env_int
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SEGMENT_SETTINGS = {
+    "directory": os.getenv("LOG_DIR", "dataset/traffic"),
+    "period": env_int("LOG_SEGMENT_PERIOD", 3600),
+    "max_bytes": env_int("LOG_SEGMENT_BYTES", 64 * 1024 * 1024),
+    "retention_hours": env_float("LOG_RETENTION_HOURS", 30 * 24),
+    "retention_bytes": env_int("LOG_RETENTION_BYTES", 1024 * 1024 * 1024),
+    "compress": os.getenv("LOG_COMPRESS", "none"),
+    "compress_level": env_int("LOG_COMPRESS_LEVEL", 3),
+}
+
+COMPRESSIONS = ("none", "zstd")
+
+SEGMENT_RE = re.compile(r"^(traffic-\d{8}-\d{6}-\d{3,})\.jsonl(\.zst)?$")
+
+
+def _stem(partition: int, period: int, seq: int) -> str:
+    start = time.strftime("%Y%m%d-%H%M%S", time.gmtime(partition * period))
+    return f"traffic-{start}-{seq:03d}"
+
+
+def _new_meta(stem: str) -> dict:
+    return {
+        "segment": stem,
+        "min_ts": None,
+        "max_ts": None,
+        "count": 0,
+        "verdicts": {},
+        "sealed": False,
+        "compressed": None,
+    }
+
+
+def _account(meta: dict, entry: dict):
+    ts = entry.get("ts")
+    if isinstance(ts, (int, float)):
+        meta["min_ts"] = ts if meta["min_ts"] is None else min(meta["min_ts"], ts)
+        meta["max_ts"] = ts if meta["max_ts"] is None else max(meta["max_ts"], ts)
+    verdict = entry.get("verdict", "unknown")
+    meta["verdicts"][verdict] = meta["verdicts"].get(verdict, 0) + 1
+    meta["count"] += 1
+
+
+def _write_meta(directory: str, meta: dict):
+    path = os.path.join(directory, meta["segment"] + ".meta.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+
+
+# ------------------------------------------------------------------ readers
+
+def _parse_lines(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn write from a crash
+
+
+def read_segment(path: str):
+    """Yield the entries stored in one segment file, compressed or not."""
+    try:
+        if path.endswith(".zst"):
+            if zstandard is None:
+                return
+            with open(path, "rb") as raw:
+                data = zstandard.ZstdDecompressor().stream_reader(raw).read()
+            yield from _parse_lines(data.decode("utf-8", errors="ignore").splitlines())
+        else:
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                yield from _parse_lines(f)
+    except OSError:
+        return
+
+
+def load_meta(directory: str, stem: str):
+    try:
+        with open(os.path.join(directory, stem + ".meta.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_segments(directory: str) -> list:
+    """Segments oldest first, as dicts with stem, path and sidecar meta (or None)."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    found = {}
+    for name in names:
+        m = SEGMENT_RE.match(name)
+        if m:
+            # While a segment is being compressed both files can exist briefly
+            if m.group(1) not in found or not m.group(2):
+                found[m.group(1)] = os.path.join(directory, name)
+    return [
+        {"stem": stem, "path": found[stem], "meta": load_meta(directory, stem)}
+        for stem in sorted(found)
+    ]
+
+
+def _overlaps(meta, since, until) -> bool:
+    if not meta or meta.get("min_ts") is None:
+        return meta is None or meta.get("count", 0) > 0
+    # The active segment's sidecar lags its data, so its max_ts is open-ended
+    if since is not None and meta.get("sealed") and meta["max_ts"] < since:
+        return False
+    if until is not None and meta["min_ts"] >= until:
+        return False
+    return True
+
+
+def iter_entries(directory: str, since: float = None, until: float = None, legacy_path: str = None):
+    """
+    Yield entries with since <= ts < until, oldest segment first. Segments
+    whose sidecar range lies outside the window are skipped unread. A legacy
+    single-file log, if given, is read before the segments.
+    """
+    sources = []
+    if legacy_path and os.path.exists(legacy_path):
+        sources.append(legacy_path)
+    sources += [s["path"] for s in list_segments(directory) if _overlaps(s["meta"], since, until)]
+    for path in sources:
+        for entry in read_segment(path):
+            ts = entry.get("ts", 0)
+            if since is not None and ts < since:
+                continue
+            if until is not None and ts >= until:
+                continue
+            yield entry
+
+
+def _reverse_lines(path: str, block_size: int = 64 * 1024):
+    """Yield the lines of a plain file last to first, reading blocks from the end."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + tail).split(b"\n")
+            tail = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode("utf-8", errors="ignore")
+        yield tail.decode("utf-8", errors="ignore")
+
+
+def read_segment_reverse(path: str):
+    """Yield the entries of one segment newest (last written) first."""
+    try:
+        if path.endswith(".zst"):
+            entries = list(read_segment(path))
+            yield from reversed(entries)
+        else:
+            yield from _parse_lines(_reverse_lines(path))
+    except OSError:
+        return
+
+
+def iter_entries_reverse(directory: str, legacy_path: str = None):
+    """Yield entries newest first: segments from the last one back, then the legacy log."""
+    for seg in reversed(list_segments(directory)):
+        yield from read_segment_reverse(seg["path"])
+    if legacy_path and os.path.exists(legacy_path):
+        yield from read_segment_reverse(legacy_path)
+
+
+# ------------------------------------------------------------------- writer
+
+class SegmentWriter:
+    """Appends encoded entries to the active segment and rotates, compresses and expires segments."""
+
+    def __init__(self, settings: dict = None):
+        self.settings = dict(SEGMENT_SETTINGS, **(settings or {}))
+        self.directory = self.settings["directory"]
+        if self.settings["compress"] not in COMPRESSIONS:
+            raise ValueError(f"Unknown log compression: {self.settings['compress']}")
+        if self.settings["compress"] == "zstd" and zstandard is None:
+            raise ImportError("zstandard is not installed")
+        self._file = None
+        self._meta = None
+        self._partition = None
+        self._seq = 0
+        self._dirty = False
+        # Sealed segments left after the last retention pass, so stats() never lists the directory
+        self._sealed_segments = 0
+        self._sealed_bytes = 0
+        self.counters = {
+            "sealed": 0,
+            "compressed": 0,
+            "expired": 0,
+        }
+
+    @property
+    def active(self):
+        return self._meta["segment"] if self._meta else None
+
+    def open(self):
+        """Create the directory and seal segments left open by a previous run."""
+        os.makedirs(self.directory, exist_ok=True)
+        for seg in list_segments(self.directory):
+            meta = seg["meta"]
+            if meta is not None and meta.get("sealed"):
+                continue
+            # Rebuild the sidecar from the data: the last one may be stale
+            meta = _new_meta(seg["stem"])
+            for entry in read_segment(seg["path"]):
+                _account(meta, entry)
+            self._finish(seg["path"], meta)
+        self._expire()
+
+    def _partition_of(self, ts) -> int:
+        if not isinstance(ts, (int, float)):
+            ts = time.time()
+        return int(ts // self.settings["period"])
+
+    def _start_segment(self, partition: int):
+        self._seq = self._seq + 1 if partition == self._partition else 1
+        self._partition = partition
+        stem = _stem(partition, self.settings["period"], self._seq)
+        while os.path.exists(os.path.join(self.directory, stem + ".meta.json")):
+            self._seq += 1
+            stem = _stem(partition, self.settings["period"], self._seq)
+        self._meta = _new_meta(stem)
+        self._file = open(os.path.join(self.directory, stem + ".jsonl"), "ab", buffering=1024 * 1024)
+
+    def write(self, items: list):
+        """Append (entry, encoded_line) pairs, rotating by period and size."""
+        for entry, line in items:
+            partition = self._partition_of(entry.get("ts"))
+            if self._file is None:
+                self._start_segment(partition)
+            elif partition > self._partition or self._file.tell() >= self.settings["max_bytes"]:
+                # Late entries from the previous period stay in the current segment;
+                # the sidecar range still covers them.
+                self.seal()
+                self._start_segment(max(partition, self._partition))
+            self._file.write(line)
+            _account(self._meta, entry)
+        if items:
+            self._dirty = True
+
+    def flush(self, fsync: bool = False):
+        """Push buffered bytes to the OS, refresh the sidecar and seal an expired period."""
+        if self._file is None:
+            return
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        if self._partition_of(time.time()) > self._partition:
+            self.seal()
+        elif self._dirty:
+            _write_meta(self.directory, self._meta)
+            self._dirty = False
+
+    def seal(self):
+        """Close the active segment, compress it if configured and apply retention."""
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        path = self._file.name
+        self._file.close()
+        self._file = None
+        meta, self._meta = self._meta, None
+        self._dirty = False
+        self._finish(path, meta)
+        self._expire()
+
+    def _finish(self, path: str, meta: dict):
+        if meta["count"] == 0:
+            os.remove(path)
+            meta_path = os.path.join(self.directory, meta["segment"] + ".meta.json")
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            return
+        if self.settings["compress"] == "zstd" and not path.endswith(".zst"):
+            path = self._compress(path)
+            meta["compressed"] = "zstd"
+        meta["sealed"] = True
+        meta["bytes"] = os.path.getsize(path)
+        _write_meta(self.directory, meta)
+        self.counters["sealed"] += 1
+
+    def _compress(self, path: str) -> str:
+        target = path + ".zst"
+        tmp = target + ".tmp"
+        compressor = zstandard.ZstdCompressor(level=self.settings["compress_level"])
+        with open(path, "rb") as src, open(tmp, "wb") as dst:
+            compressor.copy_stream(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, target)
+        os.remove(path)
+        self.counters["compressed"] += 1
+        return target
+
+    def _expire(self):
+        cutoff = time.time() - self.settings["retention_hours"] * 3600
+        sealed = [s for s in list_segments(self.directory) if s["meta"] and s["meta"].get("sealed")]
+        total = sum(s["meta"].get("bytes", 0) for s in sealed)
+        while sealed:
+            seg = sealed[0]
+            max_ts = seg["meta"].get("max_ts") or 0
+            if max_ts >= cutoff and total <= self.settings["retention_bytes"]:
+                break
+            total -= seg["meta"].get("bytes", 0)
+            os.remove(seg["path"])
+            os.remove(os.path.join(self.directory, seg["stem"] + ".meta.json"))
+            self.counters["expired"] += 1
+            sealed.pop(0)
+        self._sealed_segments = len(sealed)
+        self._sealed_bytes = total
+
+    def close(self):
+        self.seal()
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "directory": self.directory,
+            "active": self.active,
+            "segments": self._sealed_segments + (1 if self._meta else 0),
+            "bytes": self._sealed_bytes,
+            "compression": self.settings["compress"],
+        }
@@ -0,0 +1,205 @@
+"""
+Non-blocking, batched log shipping from the proxy to the dashboard backend.
+
+The request path only calls ship(), which appends to a bounded in-memory
+queue and returns immediately. A background task drains the queue, groups
+entries into batches (up to batch_size entries or flush_interval seconds,
+whichever comes first) and posts each batch to the backend's bulk ingest
+endpoint. When the queue is full the overflow policy decides what happens:
+
+    spill       - write the incoming entry to the disk spool (default)
+    drop_oldest - evict the oldest queued entry to make room
+    drop_newest - discard the incoming entry
+
+Batches that fail with a transport error or 5xx, and everything shipped
+while the spool still has a backlog, go to the DiskSpool (log_spool.py),
+whose replayer delivers them once the backend is reachable again. Batches
+the backend rejects with a 4xx go straight to the spool's dead-letter file.
+"""
+
+import asyncio
+import os
+import time
+
+import httpx
+
+from env import env_float, env_int
+from http_pool import HttpClientPool
+from log_spool import DiskSpool, is_rejection
+
+SHIPPER_SETTINGS = {
+    "url": os.getenv("INGEST_URL", "http://127.0.0.1:5000/api/ingest_logs"),
+    "batch_size": env_int("SHIP_BATCH_SIZE", 100),
+    "flush_interval": env_float("SHIP_FLUSH_INTERVAL", 1.0),
+    "max_queue": env_int("SHIP_MAX_QUEUE", 10000),
+    "overflow": os.getenv("SHIP_OVERFLOW", "spill"),
+    "timeout": env_float("SHIP_TIMEOUT", 5.0),
+}
+
+OVERFLOW_POLICIES = ("spill", "drop_oldest", "drop_newest")
+
+
+class LogShipper:
+    """Bounded async queue + background sender for /api/ingest_logs."""
+
+    def __init__(self, settings: dict = None, spool: DiskSpool = None):
+        self.settings = dict(SHIPPER_SETTINGS, **(settings or {}))
+        if self.settings["overflow"] not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {self.settings['overflow']}")
+        self._queue = asyncio.Queue(maxsize=self.settings["max_queue"])
+        self._pool = HttpClientPool({"max_connections": 4, "max_keepalive_connections": 2, "http2": False})
+        self.spool = spool if spool is not None else DiskSpool()
+        self._task = None
+        self._pending = []  # batch taken off the queue (still filling or in flight), not yet delivered
+        self.counters = {
+            "queued": 0,
+            "sent": 0,
+            "spilled": 0,
+            "dropped_overflow": 0,
+            "batches": 0,
+            "send_errors": 0,
+            "rejected": 0,
+        }
+        self.last_error = None
+
+    def ship(self, entry: dict):
+        """Enqueue one log entry without waiting. Never raises."""
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            if self.settings["overflow"] == "spill":
+                self._spill([entry])
+                return
+            self.counters["dropped_overflow"] += 1
+            if self.settings["overflow"] == "drop_newest":
+                return
+            try:
+                self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self._queue.put_nowait(entry)
+        self.counters["queued"] += 1
+
+    def _spill(self, entries: list):
+        self.counters["spilled"] += self.spool.append(entries)
+
+    async def start(self):
+        await self._pool.start()
+        self.spool.start(self._post)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """Stop the sender, flushing whatever is still queued within timeout."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.wait_for(self._flush_remaining(), timeout)
+        except asyncio.TimeoutError:
+            # Whatever could not be delivered in time survives on disk
+            self._spill(self._pending + self._take_all())
+            self._pending = []
+        await self.spool.stop()
+        await self._pool.close()
+
+    async def _flush_remaining(self):
+        pending, self._pending = self._pending, []
+        await self._send(pending)
+        while not self._queue.empty():
+            await self._send(self._take_ready([]))
+
+    def _take_all(self) -> list:
+        entries = []
+        while not self._queue.empty():
+            entries.append(self._queue.get_nowait())
+        return entries
+
+    def _take_ready(self, batch: list) -> list:
+        """Move already-queued entries into batch without waiting."""
+        while len(batch) < self.settings["batch_size"]:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _next_batch(self) -> list:
+        """
+        Wait for one entry, then collect until the batch is full or the
+        interval ends. Entries go straight into self._pending, so stop()
+        still delivers (or spills) a batch cancelled while it was filling.
+        """
+        loop = asyncio.get_running_loop()
+        batch = self._pending
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.settings["flush_interval"]
+        while len(batch) < self.settings["batch_size"]:
+            self._take_ready(batch)
+            remaining = deadline - loop.time()
+            if len(batch) >= self.settings["batch_size"] or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._send(batch)
+            self._pending = []
+
+    async def _post(self, batch: list):
+        """POST one batch; returns the HTTP status, or None on a transport error."""
+        try:
+            resp = await self._pool.request(
+                "POST", self.settings["url"], json=batch, timeout=self.settings["timeout"]
+            )
+        except httpx.HTTPError as e:
+            self.last_error = {"ts": time.time(), "error": str(e)}
+            return None
+        if resp.status_code >= 300:
+            self.last_error = {"ts": time.time(), "error": f"HTTP {resp.status_code}"}
+        return resp.status_code
+
+    async def _send(self, batch: list):
+        if not batch:
+            return
+        # While the spool holds a backlog the backend is (or just was) down:
+        # queue behind it on disk instead of hammering the backend.
+        if self.spool.backlog:
+            self._spill(batch)
+            return
+        self.counters["batches"] += 1
+        status = await self._post(batch)
+        if status is not None and 200 <= status < 300:
+            self.counters["sent"] += len(batch)
+        elif is_rejection(status):
+            self.counters["rejected"] += len(batch)
+            try:
+                await self.spool.dead_letter(batch, status)
+            except OSError:
+                self._spill(batch)
+        else:
+            self.counters["send_errors"] += 1
+            self._spill(batch)
+
+    def stats(self) -> dict:
+        c = self.counters
+        return {
+            **c,
+            "dropped": c["dropped_overflow"] + self.spool.counters["dropped_full"] + self.spool.counters["dropped_high_water"],
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self.settings["max_queue"],
+            "batch_size": self.settings["batch_size"],
+            "flush_interval": self.settings["flush_interval"],
+            "overflow": self.settings["overflow"],
+            "last_error": self.last_error,
+            "spool": self.spool.stats(),
+        }
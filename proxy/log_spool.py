@@ -0,0 +1,331 @@
+"""
+Durable on-disk spool for log entries the backend could not take.
+
+Entries are appended to segmented, append-only JSONL files under SPOOL_DIR
+(spool-0000000001.jsonl, spool-0000000002.jsonl, ...). append() only buffers
+encoded lines in memory; a flusher task writes the buffer and fsyncs once per
+fsync_interval, so a burst of spilled entries costs one fsync rather than one
+per entry. The active segment is sealed once it reaches segment_bytes.
+
+A replayer task drains sealed segments oldest-first through a send callback
+and deletes each segment once every line has been delivered. Transport errors
+and 5xx (plus 408 / 429) responses are retried with exponential backoff
+(retry_min .. retry_max seconds). A chunk the backend rejects with any other
+4xx would be rejected forever and hold up everything behind it, so it is
+moved to the dead-letter file (DEAD_LETTER_FILE in the spool directory)
+instead. Delivery is at-least-once: a segment interrupted by a restart is
+replayed from the start.
+
+Backpressure, by total spooled bytes (on disk + buffered):
+    below high_water     - everything is spooled
+    high_water .. max    - only non-"safe" verdicts are spooled
+    at max_bytes         - new entries are dropped
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+from env import env_float, env_int
+
+SPOOL_SETTINGS = {
+    "directory": os.getenv("SPOOL_DIR", "dataset/spool"),
+    "segment_bytes": env_int("SPOOL_SEGMENT_BYTES", 8 * 1024 * 1024),
+    "max_bytes": env_int("SPOOL_MAX_BYTES", 512 * 1024 * 1024),
+    "high_water": env_float("SPOOL_HIGH_WATER", 0.8),
+    "fsync_interval": env_float("SPOOL_FSYNC_INTERVAL", 0.5),
+    "replay_batch": env_int("SPOOL_REPLAY_BATCH", 200),
+    "retry_min": env_float("SPOOL_RETRY_MIN", 1.0),
+    "retry_max": env_float("SPOOL_RETRY_MAX", 60.0),
+}
+
+SEGMENT_RE = re.compile(r"^spool-(\d{10})\.jsonl$")
+
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+# 4xx statuses that still mean "try again later"
+RETRYABLE_4XX = (408, 429)
+
+
+def is_rejection(status) -> bool:
+    """True for a 4xx response the backend will give this batch again on every retry."""
+    return status is not None and 400 <= status < 500 and status not in RETRYABLE_4XX
+
+
+class DiskSpool:
+    """Segmented append-only spool with batched fsync and a backoff replayer."""
+
+    def __init__(self, settings: dict = None):
+        self.settings = dict(SPOOL_SETTINGS, **(settings or {}))
+        self.directory = self.settings["directory"]
+        os.makedirs(self.directory, exist_ok=True)
+
+        existing = self._segment_numbers()
+        self._active_seq = (existing[-1] + 1) if existing else 1
+        self._disk_bytes = sum(os.path.getsize(self._path(n)) for n in existing)
+        self._pending = []
+        self._pending_bytes = 0
+        self._write_lock = asyncio.Lock()
+        self._tasks = []
+        self.retry_delay = 0.0
+        self.counters = {
+            "spooled": 0,
+            "replayed": 0,
+            "dropped_full": 0,
+            "dropped_high_water": 0,
+            "fsyncs": 0,
+            "replay_errors": 0,
+            "dead_lettered": 0,
+        }
+        self.last_rejection = None
+
+    # ---------------------------------------------------------------- files
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"spool-{seq:010d}.jsonl")
+
+    def _segment_numbers(self) -> list:
+        nums = []
+        for name in os.listdir(self.directory):
+            m = SEGMENT_RE.match(name)
+            if m:
+                nums.append(int(m.group(1)))
+        return sorted(nums)
+
+    def _sealed_segments(self) -> list:
+        return [n for n in self._segment_numbers() if n < self._active_seq]
+
+    def _disk_usage(self) -> int:
+        """Bytes of every segment file currently on disk."""
+        total = 0
+        for n in self._segment_numbers():
+            try:
+                total += os.path.getsize(self._path(n))
+            except OSError:
+                continue  # removed meanwhile
+        return total
+
+    def _write(self, path: str, lines: list) -> int:
+        """Append lines to `path` and fsync once (runs in a thread). Returns the file size."""
+        with open(path, "ab") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def _write_dead_letter(self, lines: list):
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "ab") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def dead_letter(self, entries: list, status: int):
+        """Set aside entries the backend rejected (one JSON line each) for inspection or manual re-ingest."""
+        lines = [(json.dumps(entry) + "\n").encode("utf-8") for entry in entries]
+        await asyncio.to_thread(self._write_dead_letter, lines)
+        self.counters["dead_lettered"] += len(entries)
+        self.last_rejection = {"ts": time.time(), "status": status, "entries": len(entries)}
+
+    # ---------------------------------------------------------------- append
+
+    @property
+    def total_bytes(self) -> int:
+        return self._disk_bytes + self._pending_bytes
+
+    @property
+    def backlog(self) -> bool:
+        """True while anything is waiting to be replayed."""
+        return self.total_bytes > 0
+
+    def state(self) -> str:
+        total = self.total_bytes
+        if total >= self.settings["max_bytes"]:
+            return "full"
+        if total >= self.settings["max_bytes"] * self.settings["high_water"]:
+            return "high_water"
+        return "ok"
+
+    def append(self, entries: list) -> int:
+        """Buffer entries for the next fsync batch. Returns how many were accepted."""
+        accepted = 0
+        for entry in entries:
+            state = self.state()
+            if state == "full":
+                self.counters["dropped_full"] += 1
+                continue
+            if state == "high_water" and entry.get("verdict") == "safe":
+                self.counters["dropped_high_water"] += 1
+                continue
+            line = (json.dumps(entry) + "\n").encode("utf-8")
+            self._pending.append(line)
+            self._pending_bytes += len(line)
+            accepted += 1
+        self.counters["spooled"] += accepted
+        return accepted
+
+    async def flush(self):
+        """Write and fsync everything buffered so far."""
+        async with self._write_lock:
+            if not self._pending:
+                return
+            lines, self._pending = self._pending, []
+            size, self._pending_bytes = self._pending_bytes, 0
+            try:
+                file_size = await asyncio.to_thread(self._write, self._path(self._active_seq), lines)
+            except OSError:
+                # Keep the data buffered and try again on the next tick
+                self._pending = lines + self._pending
+                self._pending_bytes += size
+                raise
+            # Counters and the active segment only change on the event loop, never in the writer thread
+            self._disk_bytes += size
+            self.counters["fsyncs"] += 1
+            if file_size >= self.settings["segment_bytes"]:
+                self._active_seq += 1
+
+    async def _seal_active(self) -> bool:
+        """Close the active segment so the replayer can pick it up. False if there was none."""
+        async with self._write_lock:
+            if not os.path.exists(self._path(self._active_seq)):
+                return False
+            self._active_seq += 1
+            return True
+
+    async def _recount(self):
+        """Reset the byte count to what is on disk (spool files removed by hand make it drift)."""
+        async with self._write_lock:
+            self._disk_bytes = await asyncio.to_thread(self._disk_usage)
+
+    # ---------------------------------------------------------------- tasks
+
+    def start(self, send_batch):
+        """
+        Start the flusher and replayer. send_batch(list) -> HTTP status, or
+        None on a transport error (awaitable).
+        """
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._flusher()),
+                asyncio.create_task(self._replayer(send_batch)),
+            ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        try:
+            await self.flush()
+        except OSError:
+            pass
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.settings["fsync_interval"])
+            try:
+                await self.flush()
+            except OSError:
+                pass
+
+    def _read_segment(self, seq: int) -> list:
+        entries = []
+        with open(self._path(seq), "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # torn write from a crash
+        return entries
+
+    async def _backoff(self):
+        s = self.settings
+        self.retry_delay = min(s["retry_max"], max(s["retry_min"], self.retry_delay * 2))
+        await asyncio.sleep(self.retry_delay * random.uniform(0.8, 1.2))
+
+    async def _replayer(self, send_batch):
+        batch_size = self.settings["replay_batch"]
+        while True:
+            sealed = self._sealed_segments()
+            if not sealed:
+                if not self.backlog:
+                    await asyncio.sleep(self.settings["fsync_interval"])
+                    continue
+                try:
+                    await self.flush()
+                except OSError:
+                    await self._backoff()
+                    continue
+                if not await self._seal_active():
+                    # Nothing sealed and nothing to seal, yet backlog: the count is off
+                    await self._recount()
+                    await asyncio.sleep(self.settings["fsync_interval"])
+                continue
+
+            seq = sealed[0]
+            path = self._path(seq)
+            try:
+                entries = await asyncio.to_thread(self._read_segment, seq)
+            except FileNotFoundError:
+                await self._recount()  # removed by hand
+                continue
+            except OSError:
+                self.counters["replay_errors"] += 1
+                await self._backoff()
+                continue
+            offset = 0
+            while offset < len(entries):
+                chunk = entries[offset:offset + batch_size]
+                status = await send_batch(chunk)
+                if status is not None and 200 <= status < 300:
+                    offset += len(chunk)
+                    self.counters["replayed"] += len(chunk)
+                    self.retry_delay = 0.0
+                elif is_rejection(status):
+                    try:
+                        await self.dead_letter(chunk, status)
+                    except OSError:
+                        await self._backoff()
+                        continue
+                    offset += len(chunk)
+                    self.retry_delay = 0.0
+                else:
+                    self.counters["replay_errors"] += 1
+                    await self._backoff()
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                await self._recount()
+                continue
+            except OSError:
+                # Replayed again from the start once removal works (at-least-once)
+                self.counters["replay_errors"] += 1
+                await self._backoff()
+                continue
+            self._disk_bytes = max(0, self._disk_bytes - size)
+
+    def stats(self) -> dict:
+        s = self.settings
+        return {
+            **self.counters,
+            "state": self.state(),
+            "bytes": self.total_bytes,
+            "buffered_bytes": self._pending_bytes,
+            "segments": len(self._segment_numbers()),
+            "retry_delay": round(self.retry_delay, 2),
+            "last_rejection": self.last_rejection,
+            "thresholds": {
+                "high_water_bytes": int(s["max_bytes"] * s["high_water"]),
+                "max_bytes": s["max_bytes"],
+                "segment_bytes": s["segment_bytes"],
+            },
+        }
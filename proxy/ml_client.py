@@ -0,0 +1,366 @@
+"""
+ML service client with a bounded score cache.
+
+ml_service scores only "METHOD=<method> | PATH=<path>?<query>" (its
+build_text()), so two requests that differ in body, headers or host get the
+same score. The cache is keyed on a 16-byte blake2b digest of that canonical
+text, which keeps entries small and raises the hit rate compared to keying
+on the whole request.
+
+ScoreCache is an LRU with a per-entry TTL and a hard entry limit (keys and
+values are fixed-size, so the limit bounds memory). The service's
+model_tag changes whenever the model or its thresholds do; a background task
+polls /health for it, and a new tag invalidates every cached score. Every
+/predict response carries the tag it was scored under, and a score under
+any other tag than the cache's is not cached, so a response that was in
+flight across a change can neither cache a stale score nor flip the tag back.
+
+Concurrent misses for the same key are coalesced (single-flight): the first
+one starts the /predict call as a task and every other caller awaits that
+same task, sharing its result, error fallback and timeout. The task is
+shielded, so a caller that disconnects does not cancel it for the others.
+
+Distinct misses are micro-batched: MicroBatcher collects them for up to
+batch_wait_ms or batch_size items and sends them as one POST to
+<predict url>/batch ({"requests": [...]} -> {"scores": [...]}), then hands
+each score back to its caller. A service without the batch endpoint (404/405)
+is scored item by item through /predict instead.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, urlsplit, urlunsplit
+
+import httpx
+
+from env import env_float, env_int
+from http_pool import HttpClientPool
+
+ML_SETTINGS = {
+    "url": os.getenv("ML_SERVICE_URL", "http://127.0.0.1:9000/predict"),
+    "timeout": env_float("ML_TIMEOUT", 2.0),
+    "cache_size": env_int("ML_CACHE_SIZE", 50000),
+    "cache_ttl": env_float("ML_CACHE_TTL", 300.0),
+    "tag_interval": env_float("ML_TAG_INTERVAL", 5.0),
+    "batch_size": env_int("ML_BATCH_SIZE", 32),
+    "batch_wait_ms": env_float("ML_BATCH_WAIT_MS", 2.0),
+}
+
+
+def model_input(method: str, url: str) -> str:
+    """Same text ml_service's build_text() scores; keep the two in sync."""
+    try:
+        parsed = urlparse(url)
+        path_query = parsed.path + ("?" + parsed.query if parsed.query else "")
+    except ValueError:
+        path_query = url
+    return f"METHOD={method} | PATH={path_query}"
+
+
+def health_url(predict_url: str) -> str:
+    parts = urlsplit(predict_url)
+    return urlunsplit((parts.scheme, parts.netloc, "/health", "", ""))
+
+
+def is_score(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def cache_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=16).digest()
+
+
+class ScoreCache:
+    """LRU + TTL map from cache_key() to score, dropped wholesale on a new model tag."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.model_tag = None
+        self._entries = OrderedDict()  # key -> (expires_at, score)
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+            "invalidations": 0,
+            "stale_puts": 0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: bytes):
+        item = self._entries.get(key)
+        if item is None:
+            self.counters["misses"] += 1
+            return None
+        if item[0] < time.monotonic():
+            del self._entries[key]
+            self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return item[1]
+
+    def put(self, key: bytes, score: float, tag: str = None):
+        """
+        Cache a score the service computed under `tag`. A score from another
+        tag is dropped: it may predate an invalidation, and only set_tag()
+        moves the cache to a new tag.
+        """
+        if tag is not None and tag != self.model_tag:
+            if self.model_tag is not None:
+                self.counters["stale_puts"] += 1
+                return
+            self.model_tag = tag
+        self._entries[key] = (time.monotonic() + self.ttl, score)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def set_tag(self, tag: str):
+        """Record the service's model tag; a different one invalidates the cache."""
+        if tag == self.model_tag:
+            return
+        if self.model_tag is not None:
+            self._entries.clear()
+            self.counters["invalidations"] += 1
+        self.model_tag = tag
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["hits"] + c["misses"]
+        return {
+            **c,
+            "entries": len(self._entries),
+            "capacity": self.max_entries,
+            "ttl": self.ttl,
+            "hit_rate": round(c["hits"] / lookups, 4) if lookups else 0.0,
+            "model_tag": self.model_tag,
+        }
+
+
+class MicroBatcher:
+    """Groups submitted items into batches of max_size or max_wait seconds, whichever comes first."""
+
+    def __init__(self, send_batch, max_size: int, max_wait: float):
+        """
+        send_batch(list of items) -> list of results, same order (awaitable).
+        If it raises, or returns fewer results, the affected futures get the
+        exception instead, so no submitter is left waiting.
+        """
+        self._send_batch = send_batch
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.counters = {"batches": 0, "items": 0, "full_batches": 0, "largest_batch": 0}
+
+    def submit(self, item) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        c = self.counters
+        c["batches"] += 1
+        c["items"] += len(batch)
+        c["full_batches"] += len(batch) == self.max_size
+        c["largest_batch"] = max(c["largest_batch"], len(batch))
+        try:
+            results = await self._send_batch([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("batch ended without a result for this item"))
+
+    def stats(self) -> dict:
+        c = self.counters
+        return {
+            **c,
+            "pending": len(self._pending),
+            "avg_batch": round(c["items"] / c["batches"], 2) if c["batches"] else 0.0,
+            "max_size": self.max_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class MLClient:
+    """Scores requests against ml_service /predict through the cache."""
+
+    def __init__(self, settings: dict = None):
+        self.settings = dict(ML_SETTINGS, **(settings or {}))
+        self.cache = ScoreCache(self.settings["cache_size"], self.settings["cache_ttl"])
+        self._pool = HttpClientPool({"max_connections": 32, "max_keepalive_connections": 16, "http2": False})
+        self._task = None
+        self.url = self.settings["url"]  # last service URL used
+        self._inflight = {}  # cache key -> task of the /predict call in flight
+        self._batcher = MicroBatcher(
+            self._predict_many, self.settings["batch_size"], self.settings["batch_wait_ms"] / 1000
+        )
+        self._batch_endpoint = self.settings["batch_size"] > 1
+        self.counters = {"requests": 0, "batch_requests": 0, "errors": 0, "coalesced": 0}
+        self.last_error = None
+
+    async def start(self):
+        await self._pool.start()
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch_tag())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._pool.close()
+
+    async def _watch_tag(self):
+        """Pick up model/threshold changes even while every lookup is a cache hit."""
+        while True:
+            await asyncio.sleep(self.settings["tag_interval"])
+            try:
+                resp = await self._pool.request(
+                    "GET", health_url(self.url), timeout=self.settings["timeout"]
+                )
+                tag = resp.json().get("model_tag") if resp.status_code == 200 else None
+            except (httpx.HTTPError, ValueError):
+                continue
+            if tag and tag != self.cache.model_tag:
+                self.cache.set_tag(tag)
+                # A redeployed service may have gained the batch endpoint
+                self._batch_endpoint = self.settings["batch_size"] > 1
+
+    async def _predict(self, raw_request: dict, url: str) -> tuple:
+        """POST one request to ml_service. Returns (score, model_tag); score is None on failure."""
+        self.counters["requests"] += 1
+        try:
+            r = await self._pool.request("POST", url, json={"raw_request": raw_request}, timeout=self.settings["timeout"])
+            if r.status_code == 200:
+                data = r.json()
+                if isinstance(data, dict) and is_score(data.get("score", 0.0)):
+                    return data.get("score", 0.0), data.get("model_tag")
+                self.last_error = {"ts": time.time(), "error": "unexpected response body"}
+            else:
+                self.last_error = {"ts": time.time(), "error": f"HTTP {r.status_code}"}
+        except (httpx.HTTPError, ValueError) as e:
+            self.last_error = {"ts": time.time(), "error": str(e) or type(e).__name__}
+        self.counters["errors"] += 1
+        return None, None
+
+    async def _predict_batch(self, raw_requests: list, url: str):
+        """POST one batch to <url>/batch. Returns [(score, model_tag)], or None if unsupported."""
+        self.counters["batch_requests"] += 1
+        try:
+            r = await self._pool.request(
+                "POST", url.rstrip("/") + "/batch", json={"requests": raw_requests}, timeout=self.settings["timeout"]
+            )
+            if r.status_code in (404, 405):
+                self._batch_endpoint = False
+                return None
+            if r.status_code == 200:
+                data = r.json()
+                scores = data.get("scores") if isinstance(data, dict) else None
+                if isinstance(scores, list) and len(scores) == len(raw_requests):
+                    tag = data.get("model_tag")
+                    return [(score, tag) if is_score(score) else (None, None) for score in scores]
+                self.last_error = {"ts": time.time(), "error": "unexpected response body"}
+            else:
+                self.last_error = {"ts": time.time(), "error": f"HTTP {r.status_code}"}
+        except (httpx.HTTPError, ValueError) as e:
+            self.last_error = {"ts": time.time(), "error": str(e) or type(e).__name__}
+        self.counters["errors"] += 1
+        return [(None, None)] * len(raw_requests)
+
+    async def _predict_many(self, items: list) -> list:
+        """Score (raw_request, url) items, one batch call per service URL."""
+        results = [None] * len(items)
+        by_url = {}
+        for i, (raw_request, url) in enumerate(items):
+            by_url.setdefault(url, []).append(i)
+        for url, indexes in by_url.items():
+            raws = [items[i][0] for i in indexes]
+            scored = None
+            if self._batch_endpoint and len(raws) > 1:
+                scored = await self._predict_batch(raws, url)
+            if scored is None:
+                scored = await asyncio.gather(*(self._predict(raw, url) for raw in raws))
+            for i, result in zip(indexes, scored):
+                results[i] = result
+        return results
+
+    async def score(self, raw_request: dict, url: str = None) -> float:
+        """
+        Anomaly score in [0, 1] for raw_request (method/url/headers/body, the
+        /predict schema). Falls back to 0.0 if the service is unavailable;
+        failures are not cached.
+        """
+        key = cache_key(model_input(raw_request.get("method", "GET"), raw_request.get("url", "/")))
+        score = self.cache.get(key)
+        if score is not None:
+            return score
+        task = self._inflight.get(key)
+        if task is None:
+            self.url = url or self.settings["url"]
+            task = asyncio.create_task(self._fetch(key, raw_request, self.url))
+            self._inflight[key] = task
+        else:
+            self.counters["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: bytes, raw_request: dict, url: str) -> float:
+        try:
+            try:
+                score, tag = await self._batcher.submit((raw_request, url))
+            except Exception as e:
+                self.counters["errors"] += 1
+                self.last_error = {"ts": time.time(), "error": str(e) or type(e).__name__}
+                return 0.0
+            if score is None:
+                return 0.0
+            self.cache.put(key, score, tag)
+            return score
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "inflight": len(self._inflight),
+            "url": self.url,
+            "last_error": self.last_error,
+            "batch_endpoint": self._batch_endpoint,
+            "batching": self._batcher.stats(),
+            "cache": self.cache.stats(),
+        }
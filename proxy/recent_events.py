@@ -0,0 +1,62 @@
+"""
+Bounded, timestamp-ordered ring buffer of recent verdict events.
+
+The proxy keeps one buffer for every verdict and one for blocked/alert
+events, so "latest N" dashboard queries are answered from memory. Entries
+normally arrive in timestamp order and are appended; a request that finished
+after a later one started is inserted in place from the newest end, which
+only walks back over the few entries it overlaps.
+"""
+
+from collections import deque
+
+from env import env_int
+
+RECENT_SETTINGS = {
+    "events": env_int("RECENT_EVENTS_SIZE", 5000),
+    "alerts": env_int("RECENT_ALERTS_SIZE", 1000),
+}
+
+
+class RecentEvents:
+    """Newest-last deque of log entries, at most maxlen long."""
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._events = deque(maxlen=maxlen)
+
+    def __len__(self):
+        return len(self._events)
+
+    def clear(self):
+        self._events.clear()
+
+    def add(self, entry: dict):
+        events = self._events
+        ts = entry.get("ts", 0)
+        if not events or ts >= events[-1].get("ts", 0):
+            events.append(entry)
+            return
+        pos = len(events)
+        while pos > 0 and events[pos - 1].get("ts", 0) > ts:
+            pos -= 1
+        if pos == 0 and len(events) == self.maxlen:
+            return  # older than everything retained
+        if len(events) == self.maxlen:
+            events.popleft()
+            pos -= 1
+        events.insert(pos, entry)
+
+    def latest(self, limit: int, offset: int = 0):
+        """
+        Newest-first slice [offset, offset + limit), or None when the buffer
+        cannot answer it because older entries have already been evicted.
+        Negative limit / offset count as 0.
+        """
+        limit, offset = max(0, limit), max(0, offset)
+        size = len(self._events)
+        if offset + limit > size and size == self.maxlen:
+            return None
+        end = max(0, size - offset)
+        start = max(0, end - limit)
+        return [self._events[i] for i in range(end - 1, start - 1, -1)]
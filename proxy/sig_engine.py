@@ -0,0 +1,198 @@
+"""
+Compiled multi-pattern signature engine.
+
+All signatures from signatures.yml are compiled into one ruleset so each
+input is scanned once for every rule, instead of once per rule. Backends, in
+order of preference:
+
+    hyperscan - Intel Hyperscan database (reports every matching rule natively)
+    re2       - google-re2 RE2::Set (reports every matching rule natively)
+    python    - per-rule re.search fallback when neither library is installed
+
+Rules a native backend cannot compile (e.g. back-references) are kept aside
+and evaluated with Python's re module after the native scan.
+
+The native engines only agree with re on plain ASCII: Hyperscan scans bytes,
+so Unicode whitespace, Unicode case variants ("ſleep") and \b next to
+non-ASCII word characters differ; neither engine counts \x0b or \x1c-\x1f
+as \s; and RE2's $ does not match before a trailing newline. Inputs outside
+that subset are therefore checked against every rule with re. Those re-evaluated
+rules sit behind a literal-factor prefilter (see literal_prefilter.py): a rule
+is only run when one of its required literals occurs in the input, case-folded
+the way re.IGNORECASE folds it.
+
+Run bench_signatures.py to compare backends as the ruleset grows.
+"""
+
+import re
+
+from literal_prefilter import LiteralPrefilter, extract_factors, fold
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+
+BACKENDS = ("hyperscan", "re2", "python")
+
+# Inputs the native backends would not scan exactly like re.IGNORECASE does
+_NATIVE_UNSAFE = re.compile(r"[^\x00-\x0a\x0c-\x1b\x20-\x7f]|\n\Z")
+
+
+class SignatureEngine:
+    """Scan text against a whole ruleset and return the matching signature IDs."""
+
+    def __init__(self, rules: list, backend: str = "auto", prefilter: bool = True):
+        self.ids = [r["id"] for r in rules]
+        self.patterns = [r["regex"] for r in rules]
+        self.regexes = [re.compile(p, re.IGNORECASE) for p in self.patterns]
+        self.backend = None
+        self.residual = []  # rule indices the native backend could not compile
+        self.counters = {"inputs": 0, "re_fallback_inputs": 0}
+
+        candidates = BACKENDS if backend == "auto" else (backend,)
+        for name in candidates:
+            try:
+                getattr(self, f"_build_{name}")()
+            except Exception:
+                if backend != "auto":
+                    raise
+                continue
+            self.backend = name
+            break
+
+        # Literal prefilters for the rules evaluated with Python's re: the
+        # residual ones, and all of them for inputs the native scan can't take
+        self._factors = {}
+        if prefilter:
+            for i, pattern in enumerate(self.patterns):
+                literals = extract_factors(pattern)
+                if literals:
+                    self._factors[i] = literals
+        self.prefilter, self._always = self._gate(self.residual)
+        if len(self.residual) == len(self.patterns):
+            self._fallback = (self.prefilter, self._always)
+        else:
+            self._fallback = self._gate(range(len(self.patterns)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _gate(self, rules):
+        """(LiteralPrefilter or None, rules that always run) for evaluating `rules` with re."""
+        rules = set(rules)
+        if not self._factors or not rules:
+            return None, rules
+        factors = {i: self._factors[i] for i in rules if i in self._factors}
+        return LiteralPrefilter(factors), rules - set(factors)
+
+    # ---------------------------------------------------------------- builders
+
+    def _build_hyperscan(self):
+        if hyperscan is None:
+            raise ImportError("hyperscan is not installed")
+        flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH
+
+        def compile_db(indices):
+            db = hyperscan.Database()
+            db.compile(
+                expressions=[self.patterns[i].encode("utf-8") for i in indices],
+                ids=list(indices),
+                elements=len(indices),
+                flags=[flags] * len(indices),
+            )
+            return db
+
+        supported, residual = [], []
+        for i in range(len(self.patterns)):
+            try:
+                compile_db([i])
+                supported.append(i)
+            except hyperscan.error:
+                residual.append(i)
+        self._hs_db = compile_db(supported) if supported else None
+        self.residual = residual
+
+    def _build_re2(self):
+        if re2 is None:
+            raise ImportError("google-re2 is not installed")
+        options = re2.Options()
+        options.case_sensitive = False
+        rule_set = re2.Set.SearchSet(options)
+        set_to_rule, residual = [], []
+        for i, pattern in enumerate(self.patterns):
+            try:
+                rule_set.Add(pattern)
+                set_to_rule.append(i)
+            except re2.error:
+                residual.append(i)
+        rule_set.Compile()
+        self._re2_set = rule_set
+        self._re2_rules = set_to_rule
+        self.residual = residual
+
+    def _build_python(self):
+        # Python's re engine tries every branch of a large alternation at each
+        # position and loses its per-pattern literal/charset prefix scans, so a
+        # single combined regex is slower than searching rule by rule.
+        self.residual = list(range(len(self.patterns)))
+
+    # ---------------------------------------------------------------- scanning
+
+    def _match_hyperscan(self, text: str, hits: set):
+        def on_match(rule_idx, start, end, flags, context):
+            hits.add(rule_idx)
+
+        if self._hs_db is not None:
+            self._hs_db.scan(text.encode("utf-8", errors="ignore"), match_event_handler=on_match)
+
+    def _match_re2(self, text: str, hits: set):
+        hits.update(self._re2_rules[i] for i in self._re2_set.Match(text) or ())
+
+    def _match_python(self, text: str, hits: set):
+        # Every rule is residual; scan() evaluates them one by one.
+        pass
+
+    def scan(self, *texts: str) -> list:
+        """Return IDs of every rule matching any of the texts, in ruleset order."""
+        hits = set()
+        match = getattr(self, f"_match_{self.backend}")
+        for text in texts:
+            if not text:
+                continue
+            self.counters["inputs"] += 1
+            if self.backend == "python" or _NATIVE_UNSAFE.search(text):
+                self.counters["re_fallback_inputs"] += 1
+                prefilter, todo = self._fallback
+            else:
+                match(text, hits)
+                if not self.residual:
+                    continue
+                prefilter, todo = self.prefilter, self._always
+            if prefilter is not None:
+                todo = todo | prefilter.candidates(fold(text))
+            for i in todo:
+                if i not in hits and self.regexes[i].search(text):
+                    hits.add(i)
+        return [self.ids[i] for i in sorted(hits)]
+
+    def stats(self) -> dict:
+        """Backend, rule and prefilter layout plus scan counters."""
+        prefilter, always = self._fallback
+        return {
+            "backend": self.backend,
+            "rules": len(self),
+            "residual_rules": [self.ids[i] for i in self.residual],
+            "prefilter": {
+                "backend": prefilter.backend,
+                "literals": len(prefilter),
+                "unfiltered_rules": [self.ids[i] for i in sorted(always)],
+            } if prefilter is not None else None,
+            **self.counters,
+        }
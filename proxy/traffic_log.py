@@ -0,0 +1,139 @@
+"""
+Group-commit writer for the proxy traffic log (dataset/traffic/).
+
+The request path calls write(entry), which only puts the dict on a
+thread-safe queue. A dedicated writer thread owns the segment files
+(log_segments.py), serializes entries off the event loop (orjson when
+installed, json otherwise) and writes them in groups. Buffered data is
+flushed to the OS every durability_interval seconds, and additionally
+fsynced when fsync is enabled, so open/close and write syscalls no longer
+happen per request.
+"""
+
+import json
+import queue
+import threading
+import time
+
+from env import env_bool, env_float, env_int
+from log_segments import SegmentWriter
+
+try:
+    import orjson
+
+    def _encode(entry: dict) -> bytes:
+        return orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+except ImportError:
+    orjson = None
+
+    def _encode(entry: dict) -> bytes:
+        return (json.dumps(entry) + "\n").encode("utf-8")
+
+
+WRITER_SETTINGS = {
+    "durability_interval": env_float("LOG_DURABILITY_INTERVAL", 1.0),
+    "fsync": env_bool("LOG_FSYNC", False),
+    "max_batch": env_int("LOG_MAX_BATCH", 1000),
+}
+
+_STOP = object()
+
+
+class TrafficLogWriter:
+    """Single-writer, group-commit JSONL appender running in its own thread."""
+
+    def __init__(self, settings: dict = None, segments: SegmentWriter = None):
+        self.settings = dict(WRITER_SETTINGS, **(settings or {}))
+        self.segments = segments if segments is not None else SegmentWriter()
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self.counters = {
+            "written": 0,
+            "commits": 0,
+            "flushes": 0,
+            "fsyncs": 0,
+            "errors": 0,
+            "largest_commit": 0,
+        }
+
+    def write(self, entry: dict):
+        """Hand an entry to the writer thread. Never blocks."""
+        self._queue.put(entry)
+
+    def start(self):
+        if self._thread is None:
+            self.segments.open()
+            self._thread = threading.Thread(target=self._run, name="traffic-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Drain the queue, make it durable and close the file."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ---------------------------------------------------------------- thread
+
+    def _sync(self):
+        self.segments.flush(self.settings["fsync"])
+        self.counters["flushes"] += 1
+        if self.settings["fsync"]:
+            self.counters["fsyncs"] += 1
+
+    def _commit(self, batch: list):
+        items = []
+        for entry in batch:
+            try:
+                items.append((entry, _encode(entry)))
+            except (TypeError, ValueError):
+                self.counters["errors"] += 1
+        self.segments.write(items)
+        self.counters["written"] += len(items)
+        self.counters["commits"] += 1
+        self.counters["largest_commit"] = max(self.counters["largest_commit"], len(batch))
+
+    def _run(self):
+        interval = self.settings["durability_interval"]
+        max_batch = self.settings["max_batch"]
+        next_sync = time.monotonic() + interval
+        stopping = False
+        while not stopping:
+            batch = []
+            timeout = max(0.0, next_sync - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= max_batch:
+                        break
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            try:
+                if batch:
+                    self._commit(batch)
+                if stopping or time.monotonic() >= next_sync:
+                    self._sync()
+                    next_sync = time.monotonic() + interval
+            except OSError:
+                self.counters["errors"] += 1
+
+        try:
+            self.segments.close()
+        except OSError:
+            self.counters["errors"] += 1
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "pending": self._queue.qsize(),
+            "encoder": "orjson" if orjson is not None else "json",
+            "durability_interval": self.settings["durability_interval"],
+            "fsync": self.settings["fsync"],
+            "segments": self.segments.stats(),
+        }
@@ -0,0 +1,105 @@
+"""
+Differential check of SignatureEngine against the per-rule loop.
+
+Builds a seeded random corpus from the rules' literal factors, attack
+snippets, ASCII and Unicode whitespace, case look-alikes that re.IGNORECASE
+treats as equal ("İ", "ı", "ſ", the Kelvin sign) and non-ASCII word
+characters, and checks that every installed backend, with and without the
+literal prefilter, reports exactly the signatures the old loop (re.search
+per rule on body and URL) reports. Exits with status 1 on any difference.
+
+Run it after changing signatures.yml, the prefilter or a backend.
+
+Usage:
+    python verify_signatures.py [--count 20000] [--seed 1] [--backends hyperscan,re2,python]
+"""
+
+import argparse
+import random
+import re
+import sys
+
+from bench_signatures import ATTACKS, BENIGN, load_rules, naive_scan
+from literal_prefilter import extract_factors
+from sig_engine import BACKENDS, SignatureEngine
+
+SNIPPETS = [
+    "union select", "union all select", "' or 1=1--", "; drop table", "sleep(3)", "sleep ( 10 )",
+    "information_schema", "<script>x</script>", "<img src=x onerror=", "javascript:alert(1)",
+    "onclick=", "; ls", ";id", "cat", "curl", "../", "/etc/passwd", "http://x/a.php", "?redirect=http://",
+    "<!ENTITY x SYSTEM 'file", "x.php", "shell.sh", "0x4142", "?a=1&a=2", "A" * 100,
+]
+SEPARATORS = ["", " ", "  ", "\t", "\n", "\r\n", "\x0b", "\x0c", "\x1c", "\x1f", "\x85", "\xa0", " ", "　"]
+LOOKALIKES = {"i": ["I", "İ", "ı"], "s": ["S", "ſ"], "k": ["K", "K"]}
+NOISE = "abcxyz019_-=/?&;:'\"<>()%.éßİıſ中٣K"
+
+
+def mutate(rng: random.Random, text: str) -> str:
+    out = []
+    for ch in text:
+        r = rng.random()
+        if r < 0.05 and ch.lower() in LOOKALIKES:
+            out.append(rng.choice(LOOKALIKES[ch.lower()]))
+        elif r < 0.15:
+            out.append(ch.swapcase())
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+def build_corpus(rules: list, count: int, seed: int) -> list:
+    """[(body, url)] pairs; most inputs combine literals, snippets, separators and noise."""
+    rng = random.Random(seed)
+    literals = sorted({lit for r in rules for lit in (extract_factors(r["regex"]) or ())})
+    pieces = literals + SNIPPETS
+    corpus = list(BENIGN) + list(ATTACKS)
+    while len(corpus) < count:
+        parts = []
+        for _ in range(rng.randint(1, 5)):
+            kind = rng.random()
+            if kind < 0.6:
+                parts.append(mutate(rng, rng.choice(pieces)))
+            elif kind < 0.8:
+                parts.append("".join(rng.choice(NOISE) for _ in range(rng.randint(1, 4))))
+            else:
+                parts.append(rng.choice(SEPARATORS))
+            parts.append(rng.choice(SEPARATORS))
+        text = "".join(parts)
+        if rng.random() < 0.1:
+            text += "\n"
+        corpus.append((text, "") if rng.random() < 0.5 else ("", text))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000, help="corpus size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    args = parser.parse_args()
+
+    rules = load_rules()
+    compiled = [(r["id"], re.compile(r["regex"], re.IGNORECASE)) for r in rules]
+    corpus = build_corpus(rules, args.count, args.seed)
+    expected = [naive_scan(compiled, body, url) for body, url in corpus]
+    print(f"{len(corpus)} inputs, {sum(bool(e) for e in expected)} matching at least one rule")
+
+    failed = False
+    for name in args.backends.split(","):
+        for prefilter in (True, False):
+            label = f"{name}{'' if prefilter else ' (no prefilter)'}"
+            try:
+                engine = SignatureEngine(rules, backend=name, prefilter=prefilter)
+            except Exception as e:
+                print(f"{label:>28}: skipped ({e})")
+                continue
+            diffs = [(i, got) for i, got in enumerate(engine.scan(b, u) for b, u in corpus) if got != expected[i]]
+            print(f"{label:>28}: {len(diffs)} differing inputs" + ("" if diffs else "  ok"))
+            for i, got in diffs[:5]:
+                print(f"    {corpus[i]!r}: expected {expected[i]}, got {got}")
+            failed = failed or bool(diffs)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()